@@ -0,0 +1,330 @@
+#! /usr/bin/env python
+"""Throughput and accuracy benchmark of find-conserved-motifs and find-query.
+
+A synthetic corpus of fSHAPE-like series is generated with copies of a known
+pattern planted at random positions. Both tools are then run on it stage by
+stage, as their scripts run them, and every stage is timed (wall clock and CPU
+time, worker processes included) and memory-profiled (the peak resident
+memory of the process during the stage, see instrument.py of the tools). The
+recall of the planted copies is reported with the timings as JSON, so the
+results of two runs can be compared.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONSERVED = os.path.join(ROOT, "find-conserved-motifs")
+QUERY = os.path.join(ROOT, "find-query")
+PATTERN = os.path.join(ROOT, "IRE-dataset", "fSHAPE_true_pattern.txt")
+# modules of the same name in both tool directories
+SHARED = ("corpus", "plots")
+BASES = np.array([b"A", b"C", b"G", b"T"])
+
+
+def load_tool(directory: str, filename: str, name: str):
+    """Import a tool script, with its directory first on the module path."""
+    for module in SHARED:
+        sys.modules.pop(module, None)
+    sys.path.insert(0, directory)
+    try:
+        spec = importlib.util.spec_from_file_location(
+            name, os.path.join(directory, filename)
+        )
+        module = importlib.util.module_from_spec(spec)
+        # worker processes find the functions of the tool by its module name
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(directory)
+    return module
+
+
+instrument = load_tool(QUERY, "instrument.py", "instrument")
+
+
+def generate(
+    pattern: np.ndarray,
+    series: int,
+    length: int,
+    nan_fraction: float,
+    noise: float,
+    planted_fraction: float,
+    rng: np.random.Generator,
+):
+    """Random fSHAPE-like series, some with a noisy copy of the pattern.
+
+    The background is mostly low reactivity with a few high peaks. Returns the
+    list of (fshapes, bases) and, per series, the position of the planted copy
+    or None. Undefined data points are never put into a planted copy.
+    """
+    m = len(pattern)
+    scale = noise * np.std(pattern)
+    result, planted = [], []
+    for _ in range(series):
+        fshapes = rng.normal(0.0, 0.5, length)
+        peaks = rng.random(length) < 0.05
+        fshapes[peaks] += rng.exponential(2.0, np.sum(peaks))
+        bases = rng.choice(BASES, length)
+        missing = rng.random(length) < nan_fraction
+        position = None
+        if length >= m and rng.random() < planted_fraction:
+            position = int(rng.integers(0, length - m + 1))
+            fshapes[position : position + m] = pattern + rng.normal(0.0, scale, m)
+            missing[position : position + m] = False
+        fshapes[missing] = np.nan
+        result.append((fshapes, bases))
+        planted.append(position)
+    return result, planted
+
+
+def write_corpus(directory: str, series) -> List[str]:
+    """Write the series as 2-column (fSHAPE, sequence) raw input files."""
+    paths = []
+    for i, (fshapes, bases) in enumerate(series):
+        path = os.path.join(directory, f"synthetic_{i}.txt")
+        with open(path, "w") as f:
+            for value, base in zip(fshapes, bases):
+                value = "NA" if np.isnan(value) else repr(float(value))
+                f.write(f"{value}\t{base.decode()}\n")
+        paths.append(path)
+    return paths
+
+
+class Stages:
+    """Wall clock time, CPU time and peak resident memory of named stages.
+
+    The peak is restarted before a stage and read after it, so the memory is not
+    traced while the stage is timed.
+    """
+
+    def __init__(self):
+        self.results: Dict[str, Dict] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        instrument.reset_peak_rss()
+        wall, cpu = time.perf_counter(), instrument.cpu_time()
+        try:
+            yield
+        finally:
+            self.results[name] = {
+                "wall_seconds": time.perf_counter() - wall,
+                "cpu_seconds": instrument.cpu_time() - cpu,
+                "peak_rss_bytes": instrument.high_water_mark(),
+                "children_peak_rss_bytes_so_far": instrument.peak_rss(
+                    resource.RUSAGE_CHILDREN
+                ),
+            }
+
+
+def overlaps(found: int, planted: int, m: int) -> bool:
+    """Whether a motif at `found` covers at least half of the planted copy."""
+    return abs(found - planted) <= m // 2
+
+
+def bench_conserved(paths: List[str], planted: List, m: int, args) -> Dict:
+    fcm = load_tool(CONSERVED, "find-conserved-motifs.py", "find_conserved_motifs")
+    from scipy.cluster.hierarchy import linkage
+
+    stages = Stages()
+    with stages.stage("parse"):
+        names, series = fcm.load_series(paths)
+    with stages.stage("silence"):
+        silenced = [fcm.silence(values, m, args.threshold) for values, _ in series]
+    with stages.stage("clear"):
+        indexes = [fcm.clear_index(values, m) for values in silenced]
+        kept = [k for k, index in enumerate(indexes) if index is not None]
+        Ts = [np.where(indexes[k] < 0, np.nan, silenced[k][indexes[k]]) for k in kept]
+        seq = [np.where(indexes[k] < 0, b"N", series[k][1][indexes[k]]) for k in kept]
+        segments = [fcm.Segments.from_series(T) for T in Ts]
+    with stages.stage("ostinato"):
+        radius, Ts_idx, subseq_idx = fcm.consensus.ostinato(segments, m, args.jobs)[:3]
+    with stages.stage("alignment"):
+        seed_motif = Ts[Ts_idx][subseq_idx : subseq_idx + m]
+        nn = fcm.align_motifs(
+            Ts,
+            segments,
+            seq,
+            Ts_idx,
+            subseq_idx,
+            seed_motif,
+            [names[k] for k in kept],
+            m,
+            [],
+        )
+    with stages.stage("dendrogram"):
+        dp = fcm.aligned_motifs_distances(Ts, nn, m)
+        if len(Ts) > 1:
+            linkage(dp, optimal_ordering=True)
+
+    # positions in the cleared series are mapped back to the input files
+    found = {k: int(indexes[k][i]) for k, i in zip(kept, nn)}
+    hits = [
+        k in found and overlaps(found[k], position, m)
+        for k, position in enumerate(planted)
+        if position is not None
+    ]
+    return {
+        "stages": stages.results,
+        "radius": float(radius),
+        "series_kept": len(kept),
+        "recall": float(np.mean(hits)) if hits else None,
+    }
+
+
+def bench_query(paths: List[str], planted: List, pattern_path: str, args) -> Dict:
+    fq = load_tool(QUERY, "find-query.py", "find_query")
+    stages = Stages()
+    query = fq.Input.from_file(pattern_path)
+    m = len(query)
+    with stages.stage("parse"):
+        inputs = [fq.Input.from_file(path) for path in paths]
+    with stages.stage("compute_profiles"):
+        profiled = fq.compute_profiles(inputs, [query], args.jobs)[0]
+    with stages.stage("filter"):
+        motifs = fq.Candidates.from_inputs(profiled, m)
+        motifs = motifs.take(~motifs.with_nans()).sorted()
+    with tempfile.TemporaryDirectory() as directory:
+        with stages.stage("export"):
+            fq.export(motifs, query, os.path.join(directory, "output"))
+            filtered = motifs.take(~motifs.negative(query))
+            fq.export(filtered, query, os.path.join(directory, "output-filtered"))
+
+    # a planted copy is found if one of the as many best motifs covers it
+    positions = {
+        os.path.basename(path): position
+        for path, position in zip(paths, planted)
+        if position is not None
+    }
+    hits = set()
+    best = motifs.take(slice(len(positions)))
+    for i, index in zip(best.series.tolist(), best.starts.tolist()):
+        name = profiled[i].name
+        position = positions.get(name)
+        if position is not None and overlaps(index, position, m):
+            hits.add(name)
+    return {
+        "stages": stages.results,
+        "motifs": len(motifs),
+        "recall": len(hits) / len(positions) if positions else None,
+    }
+
+
+def versions() -> Dict:
+    result = {"python": platform.python_version()}
+    for name in ("numpy", "scipy", "stumpy", "matrixprofile"):
+        module = sys.modules.get(name)
+        if module is not None:
+            result[name] = getattr(module, "__version__", None)
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="benchmark both tools on a synthetic corpus with planted motifs"
+    )
+    parser.add_argument("--series", help="number of series", type=int, default=100)
+    parser.add_argument("--length", help="length of a series", type=int, default=500)
+    parser.add_argument(
+        "--nan-fraction",
+        help="fraction of undefined data points",
+        type=float,
+        default=0.05,
+    )
+    parser.add_argument(
+        "--noise",
+        help="standard deviation of the noise added to the planted copies, "
+        "relative to the standard deviation of the pattern",
+        type=float,
+        default=0.1,
+    )
+    parser.add_argument(
+        "--planted-fraction",
+        help="fraction of the series with a planted copy of the pattern",
+        type=float,
+        default=1.0,
+    )
+    parser.add_argument(
+        "--pattern", help="file of the planted pattern", default=PATTERN
+    )
+    parser.add_argument("--seed", help="random seed", type=int, default=0)
+    parser.add_argument(
+        "--threshold",
+        help="silencing threshold of find-conserved-motifs",
+        type=float,
+        default=1.0,
+    )
+    parser.add_argument(
+        "--jobs", help="number of worker processes of the tools", type=int, default=1
+    )
+    parser.add_argument(
+        "--tools",
+        help="tools to benchmark",
+        choices=["conserved", "query", "both"],
+        default="both",
+    )
+    parser.add_argument(
+        "--corpus",
+        help="keep the generated input files in this directory",
+    )
+    parser.add_argument(
+        "-o", "--output", help="JSON file of the results (default: standard output)"
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    sys.path.insert(0, QUERY)
+    from corpus import read_series
+
+    sys.path.remove(QUERY)
+    pattern = read_series(args.pattern)[0]
+    rng = np.random.default_rng(args.seed)
+    series, planted = generate(
+        pattern,
+        args.series,
+        args.length,
+        args.nan_fraction,
+        args.noise,
+        args.planted_fraction,
+        rng,
+    )
+
+    report = {"config": vars(args), "tools": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        directory = args.corpus or directory
+        os.makedirs(directory, exist_ok=True)
+        paths = write_corpus(directory, series)
+        if args.tools in ("conserved", "both"):
+            report["tools"]["find-conserved-motifs"] = bench_conserved(
+                paths, planted, len(pattern), args
+            )
+        if args.tools in ("query", "both"):
+            report["tools"]["find-query"] = bench_query(
+                paths, planted, args.pattern, args
+            )
+    report["versions"] = versions()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+../find-query/cache.py
\ No newline at end of file
@@ -0,0 +1,421 @@
+#!/usr/bin/python
+
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from stumpy import config
+from segments import Segments
+import instrument
+
+BLOCK_SIZE = 1024
+
+class Series:
+    """All series concatenated, with the prefix sums shared by every window length.
+
+    The window statistics of any length are differences of the prefix sums, and
+    the sliding dot products of length m + 1 are those of length m plus one
+    product, so a scan over several lengths touches the data once per length.
+    A series is an array or a segments.Segments, of which only the values of
+    the runs are kept: windows never reach past the end of a run and `position`
+    gives the position in its series of every value.
+    """
+
+    def __init__(self, series):
+        values, positions, run_ends = [], [], []
+        end = 0
+        for s in series:
+            if isinstance(s, Segments):
+                runs = np.diff(s.offsets)
+                values.append(s.values)
+                positions.append(s.positions())
+            else:
+                runs = np.array([len(s)], dtype=np.int64)
+                values.append(s)
+                positions.append(np.arange(len(s)))
+            run_ends.append(end + np.repeat(np.cumsum(runs), runs))
+            end += len(values[-1])
+        lengths = [len(v) for v in values]
+        self.offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+        self.values = np.concatenate(values).astype(np.float64) if values else np.empty(0)
+        self.finite = np.isfinite(self.values)
+        self.values[~self.finite] = 0
+        self.owner = np.repeat(np.arange(len(values)), lengths)
+        self.position = np.concatenate(positions + [np.empty(0, np.int64)])
+        self.run_ends = np.concatenate(run_ends + [np.empty(0, np.int64)])
+        self.sums = np.concatenate(([0], np.cumsum(self.values)))
+        self.squares = np.concatenate(([0], np.cumsum(np.square(self.values))))
+        changes = np.append(self.values[1:] != self.values[:-1], False)
+        self.changes = np.concatenate(([0], np.cumsum(changes)))
+
+    def __len__(self):
+        return len(self.values)
+
+    def positions(self, series):
+        # the positions of the given series, in their order
+        return np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in series] + [np.empty(0, np.int64)])
+
+    def statistics(self, m, points):
+        """Mean, standard deviation, constancy and validity of the windows of length m.
+
+        One entry per position of the concatenated series. A window is valid if
+        it lies within one run of a series and all its points are in `points`.
+        """
+        n = len(self)
+        starts = np.arange(n)
+        ends = np.minimum(starts + m, n)
+        missing = np.concatenate(([0], np.cumsum(~points)))
+        valid = (starts + m <= self.run_ends) & (missing[ends] == missing[starts])
+        means = (self.sums[ends] - self.sums[starts]) / m
+        variances = (self.squares[ends] - self.squares[starts]) / m - np.square(means)
+        stds = np.sqrt(np.maximum(variances, 0))
+        constant = self.changes[np.maximum(ends - 1, starts)] == self.changes[starts]
+        return means, stds, constant, valid
+
+def squared_distances(m, QT, rows, columns):
+    # z-normalized squared distances between windows given by their (means,
+    # standard deviations, constancy), the way stumpy computes them: constant
+    # windows are at 0 from each other and at sqrt(m) from all others
+    D2 = QT - m * np.outer(rows[0], columns[0])
+    D2 /= np.maximum(m * np.outer(rows[1], columns[1]), config.STUMPY_DENOM_THRESHOLD)
+    np.minimum(D2, 1.0, out=D2)
+    D2 = np.abs(2 * m * (1.0 - D2))
+    if rows[2].any() or columns[2].any():
+        D2[rows[2]] = m
+        D2[:, columns[2]] = m
+        D2[np.ix_(rows[2], columns[2])] = 0
+    return D2
+
+def nearest_neighbor_distances(series, statistics, block_size=BLOCK_SIZE):
+    """Distance from every window to its nearest neighbor in every series.
+
+    `statistics` maps window lengths to the result of Series.statistics. Returns
+    a (len(series), number of series) array per length, infinite for invalid
+    windows and series without a valid window. The dot products are kept for
+    one block of rows and one block of columns at a time.
+    """
+    n = len(series)
+    lengths = sorted(statistics)
+    padded = np.append(series.values, np.zeros(lengths[-1]))
+    nns = {m: np.full((n, len(series.offsets) - 1), np.inf) for m in lengths}
+    # the dot products are only computed between windows valid for some length
+    used = np.flatnonzero(np.logical_or.reduce([statistics[m][3] for m in lengths]))
+    for start in range(0, len(used), block_size):
+        rows = used[start : start + block_size]
+        for column_start in range(0, len(used), block_size):
+            columns = used[column_start : column_start + block_size]
+            QT = np.zeros((len(rows), len(columns)))
+            for t in range(lengths[-1]):
+                QT += np.outer(padded[rows + t], padded[columns + t])
+                m = t + 1
+                if m not in statistics:
+                    continue
+                means, stds, constant, valid = statistics[m]
+                local = np.flatnonzero(valid[rows])
+                index = np.flatnonzero(valid[columns])
+                if len(local) == 0 or len(index) == 0:
+                    continue
+                row_index = rows[local]
+                column_index = columns[index]
+                D2 = squared_distances(m, QT[np.ix_(local, index)], (means[row_index], stds[row_index], constant[row_index]), (means[column_index], stds[column_index], constant[column_index]))
+                # the windows of a series are consecutive and may span several
+                # blocks of columns, the nearest neighbor is the closest of all
+                owners = series.owner[column_index]
+                bounds = np.flatnonzero(np.diff(owners, prepend=-1))
+                block = np.ix_(row_index, owners[bounds])
+                nns[m][block] = np.minimum(nns[m][block], np.sqrt(np.minimum.reduceat(D2, bounds, axis=1)))
+    return nns
+
+def sliding_dot_products(padded, rows, columns, m):
+    # the dot products of the windows of length m starting at rows and at
+    # columns, summed one point at a time as nearest_neighbor_distances sums
+    # them, so both give the same distances to the last bit
+    QT = np.zeros((len(rows), len(columns)))
+    for t in range(m):
+        QT += np.outer(padded[rows + t], padded[columns + t])
+    return QT
+
+def series_nearest_neighbor_distances(series, statistics, m, rows, columns, block_size=BLOCK_SIZE):
+    """Distance from every window of the series `rows` to its nearest neighbor in each of the series `columns`.
+
+    Returns one row per position of the `rows` series, in their order, and one
+    column per series of `columns`, like the rows and columns of
+    nearest_neighbor_distances.
+    """
+    means, stds, constant, valid = statistics
+    windows = np.lib.stride_tricks.sliding_window_view(np.append(series.values, np.zeros(m)), m)[: len(series)]
+    positions = series.positions(rows)
+    nns = np.full((len(positions), len(columns)), np.inf)
+    index = np.flatnonzero(valid[positions])
+    for k, i in enumerate(columns):
+        column_index = series.offsets[i] + np.flatnonzero(valid[series.offsets[i] : series.offsets[i + 1]])
+        if len(column_index) == 0:
+            continue
+        column_statistics = means[column_index], stds[column_index], constant[column_index]
+        for start in range(0, len(index), block_size):
+            block = index[start : start + block_size]
+            row_index = positions[block]
+            D2 = squared_distances(m, windows[row_index] @ windows[column_index].T, (means[row_index], stds[row_index], constant[row_index]), column_statistics)
+            nns[block, k] = np.sqrt(D2.min(axis=1))
+    return nns
+
+def distance_profile(series, statistics, m, start):
+    means, stds, constant, valid = statistics
+    window = series.values[start : start + m]
+    padded = np.append(series.values, np.zeros(m))
+    QT = np.lib.stride_tricks.sliding_window_view(padded, m)[: len(series)] @ window
+    row = slice(start, start + 1)
+    D2 = squared_distances(m, QT[None, :], (means[row], stds[row], constant[row]), (means, stds, constant))[0]
+    D2[~valid] = np.inf
+    return np.sqrt(D2)
+
+def best_match(segments, query):
+    """Start of the window of a segments.Segments closest to the query, as the argmin of stumpy.core.mass.
+
+    Only the windows within a run are computed. Returns 0 when there is none,
+    like the argmin of a profile of infinite distances.
+    """
+    m = len(query)
+    series = Series([segments])
+    means, stds, constant, valid = series.statistics(m, series.finite)
+    index = np.flatnonzero(valid)
+    if len(index) == 0:
+        return 0
+    windows = np.lib.stride_tricks.sliding_window_view(series.values, m)[index]
+    query_statistics = np.array([query.mean()]), np.array([query.std()]), np.array([np.ptp(query) == 0])
+    D2 = squared_distances(m, (windows @ query)[None, :], query_statistics, (means[index], stds[index], constant[index]))[0]
+    return int(series.position[index[np.argmin(D2)]])
+
+def across_series_nearest_neighbors(series, statistics, m, start, active):
+    profile = distance_profile(series, statistics, m, start)
+    radii = np.empty(len(active))
+    starts = np.empty(len(active), dtype=np.int64)
+    for k, i in enumerate(active):
+        offset = series.offsets[i]
+        starts[k] = offset + np.argmin(profile[offset : series.offsets[i + 1]])
+        radii[k] = profile[starts[k]]
+    return radii, starts
+
+def central_motif(series, statistics, m, radius, start, active):
+    # the most central of the motifs with the best radius, as
+    # stumpy.ostinato._get_central_motif picks it
+    nns_radii, nns_starts = across_series_nearest_neighbors(series, statistics, m, start, active)
+    mean_radius = nns_radii.mean()
+    for candidate in nns_starts[np.isclose(nns_radii, radius)]:
+        candidate_radii, _ = across_series_nearest_neighbors(series, statistics, m, candidate, active)
+        if np.isclose(candidate_radii.max(), radius) and candidate_radii.mean() < mean_radius:
+            start = candidate
+            mean_radius = candidate_radii.mean()
+    return start
+
+def consensus(series, nns, statistics, m):
+    """Best radius of the windows of length m and the start of the central motif.
+
+    Only the series with at least one valid window take part. Returns None when
+    there is no valid window.
+    """
+    means, stds, constant, valid = statistics
+    active = np.flatnonzero(np.logical_or.reduceat(valid, series.offsets[:-1]))
+    if len(active) == 0:
+        return None
+    others = nns[:, active]
+    others[active[None, :] == series.owner[:, None]] = 0
+    radii = np.max(others, axis=1, initial=0.0)
+    radii[~valid] = np.inf
+    start = int(np.argmin(radii))
+    radius = radii[start]
+    return radius, central_motif(series, statistics, m, radius, start, active), active
+
+def scan(values, points, lengths, block_size=BLOCK_SIZE):
+    """Consensus motif of the series for every length in `lengths`.
+
+    `points[m]` lists, per series, the points windows of length m may use.
+    Returns, per length, (radius, series index, subsequence index, indices of
+    the series taking part) or None.
+    """
+    # empty series have no windows and would break the reductions per series
+    nonempty = np.array([i for i, v in enumerate(values) if len(v) > 0], dtype=np.int64)
+    series = Series([values[i] for i in nonempty])
+    statistics = {}
+    for m in lengths:
+        kept = [points[m][i] for i in nonempty]
+        statistics[m] = series.statistics(m, (np.concatenate(kept) if kept else np.empty(0, bool)) & series.finite)
+    nns = nearest_neighbor_distances(series, statistics, block_size) if len(series) else {}
+    results = {}
+    for m in lengths:
+        result = consensus(series, nns[m], statistics[m], m) if len(series) else None
+        if result is not None:
+            radius, start, active = result
+            i = series.owner[start]
+            result = radius, nonempty[i], series.position[start], nonempty[active]
+        results[m] = result
+    return results
+
+class TopConsensus:
+    """The best consensus motifs of length m, one after another.
+
+    The nearest neighbor distances of all windows are computed once. After a
+    motif is found, `exclude` drops the windows overlapping its aligned motifs
+    from the search, and only the distances from a window to a series whose
+    nearest neighbor was dropped are computed again. Every motif is the one
+    `consensus` finds on the windows left, as if all distances were computed
+    anew.
+    """
+
+    def __init__(self, values, m, block_size=BLOCK_SIZE):
+        self.series = Series(values)
+        self.m = m
+        self.block_size = block_size
+        self.points = self.series.finite.copy()
+        self.statistics = self.series.statistics(m, self.points)
+        self.padded = np.append(self.series.values, np.zeros(m))
+        self.nns = np.full((len(self.series), len(values)), np.inf)
+        if len(self.series):
+            self.nns = nearest_neighbor_distances(self.series, {m: self.statistics}, block_size)[m]
+
+    def next(self):
+        """(radius, series index, subsequence index, number of series taking part) of the best motif left, or None.
+
+        A series takes part while it has a window left.
+        """
+        result = consensus(self.series, self.nns, self.statistics, self.m) if len(self.series) else None
+        if result is None:
+            return None
+        radius, start, active = result
+        return radius, int(self.series.owner[start]), int(self.series.position[start]), len(active)
+
+    def exclude(self, nn):
+        """Drop the windows overlapping the motif at nn[i] of every series i."""
+        series, m = self.series, self.m
+        starts = np.asarray(nn)[series.owner]
+        self.points &= (series.position < starts) | (series.position >= starts + m)
+        valid = self.statistics[3]
+        self.statistics = series.statistics(m, self.points)
+        means, stds, constant, now_valid = self.statistics
+        self.nns[~now_valid] = np.inf
+        dropped = np.flatnonzero(valid & ~now_valid)
+        rows = np.flatnonzero(now_valid)
+        if len(dropped) == 0 or len(rows) == 0:
+            return
+
+        def statistics(index):
+            return means[index], stds[index], constant[index]
+
+        # the dropped windows are grouped by series, a nearest neighbor
+        # distance is stale if it is that of a dropped window
+        owners = series.owner[dropped]
+        bounds = np.flatnonzero(np.diff(owners, prepend=-1))
+        groups = owners[bounds]
+        stale = np.zeros((len(rows), len(groups)), dtype=bool)
+        for start in range(0, len(rows), self.block_size):
+            block = rows[start : start + self.block_size]
+            D2 = squared_distances(m, sliding_dot_products(self.padded, block, dropped, m), statistics(block), statistics(dropped))
+            nearest = np.sqrt(np.minimum.reduceat(D2, bounds, axis=1))
+            stale[start : start + len(block)] = nearest <= self.nns[np.ix_(block, groups)]
+        for k, i in enumerate(groups):
+            columns = series.offsets[i] + np.flatnonzero(now_valid[series.offsets[i] : series.offsets[i + 1]])
+            recomputed = rows[stale[:, k]]
+            instrument.count('distances recomputed', len(recomputed))
+            if len(columns) == 0:
+                self.nns[recomputed, i] = np.inf
+                continue
+            for start in range(0, len(recomputed), self.block_size):
+                block = recomputed[start : start + self.block_size]
+                D2 = squared_distances(m, sliding_dot_products(self.padded, block, columns, m), statistics(block), statistics(columns))
+                self.nns[block, i] = np.sqrt(D2.min(axis=1))
+
+# state of the candidate search in the current (worker) process
+_search = None
+
+def init_search(values, m, best, started, deadline, max_candidates):
+    global _search
+    series = Series(values)
+    statistics = series.statistics(m, series.finite)
+    active = np.flatnonzero(np.logical_or.reduceat(statistics[3], series.offsets[:-1]))
+    windows = np.lib.stride_tricks.sliding_window_view(np.append(series.values, np.zeros(m)), m)[: len(series)]
+    _search = series, statistics, active, windows, m, best, started, deadline, max_candidates
+
+def search_candidate(j):
+    """Best radius of the windows of series j, unless it cannot match the best one.
+
+    The nearest neighbors in the other series are computed one series at a
+    time, and windows are dropped as soon as their radius exceeds the best
+    radius found so far by any process. Windows tied with it are kept, so the
+    result does not depend on which process found the best radius first.
+    Returns (radius, window start, minimal distances to the other series),
+    radius and start are inf and -1 when no window of j matches the best
+    radius, and None when the search budget is exhausted. The minimal distance
+    to a series is NaN unless it was computed for all windows of j.
+    """
+    series, statistics, active, windows, m, best, started, deadline, max_candidates = _search
+    with started.get_lock():
+        if (max_candidates is not None and started.value >= max_candidates) or (deadline is not None and time.time() > deadline):
+            return None
+        started.value += 1
+
+    means, stds, constant, valid = statistics
+    k = len(series.offsets) - 1
+    rows = series.offsets[j] + np.flatnonzero(valid[series.offsets[j] : series.offsets[j + 1]])
+    radii = np.zeros(len(rows))
+    alive = np.ones(len(rows), dtype=bool)
+    minima = np.full(k, np.nan)
+    # as stumpy does, start with the next series
+    for i in np.roll(active, -np.searchsorted(active, j + 1)):
+        if i == j:
+            continue
+        columns = series.offsets[i] + np.flatnonzero(valid[series.offsets[i] : series.offsets[i + 1]])
+        candidates = rows[alive]
+        D = np.sqrt(squared_distances(m, windows[candidates] @ windows[columns].T, (means[candidates], stds[candidates], constant[candidates]), (means[columns], stds[columns], constant[columns])))
+        if alive.all():
+            minima[i] = D.min()
+        radii[alive] = np.maximum(radii[alive], D.min(axis=1))
+        alive[alive] = radii[alive] <= best.value
+        if not alive.any():
+            return np.inf, -1, minima
+
+    start = np.flatnonzero(alive)[np.argmin(radii[alive])]
+    with best.get_lock():
+        if radii[start] < best.value:
+            best.value = radii[start]
+    return radii[start], rows[start], minima
+
+def ostinato(values, m, jobs=1, time_budget=None, max_candidates=None):
+    """Consensus motif of length m, like stumpy.ostinato, in parallel and anytime.
+
+    `values` are the series, arrays or segments.Segments (see Series).
+    Every series is a candidate searched by `search_candidate`, by `jobs`
+    processes sharing the best radius. With `time_budget` (seconds) or
+    `max_candidates` the search stops early and returns the best consensus
+    found so far. Returns (radius, series index, subsequence index, gap, number
+    of candidate series searched), where the optimal radius is at least
+    radius - gap (gap is 0 when all candidates were searched).
+    """
+    best = multiprocessing.Value('d', np.inf)
+    started = multiprocessing.Value('l', 0)
+    deadline = None if time_budget is None else time.time() + time_budget
+    arguments = (values, m, best, started, deadline, max_candidates)
+    init_search(*arguments)
+    series, statistics, active = _search[:3]
+    if jobs > 1:
+        with ProcessPoolExecutor(jobs, initializer=init_search, initargs=arguments) as pool:
+            results = list(pool.map(search_candidate, active))
+    else:
+        results = [search_candidate(j) for j in active]
+
+    searched = [j for j, result in zip(active, results) if result is not None]
+    found = [(result[0], result[1]) for result in results if result is not None and result[1] >= 0]
+    if not found:
+        return None
+    # ties are resolved by the first window, as consensus resolves them
+    radius, start = min(found)
+
+    # every window of a series that was not searched is at least as far from
+    # a searched series as the closest pair of windows of the two series
+    bound = radius
+    for j in active:
+        if j not in searched:
+            minima = [result[2][j] for result in results if result is not None]
+            bound = min(bound, np.nanmax(minima, initial=0.0))
+    start = central_motif(series, statistics, m, radius, start, active)
+    i = series.owner[start]
+    return radius, i, series.position[start], radius - bound, len(searched)
@@ -0,0 +1 @@
+../find-query/corpus.py
\ No newline at end of file
@@ -1,31 +1,127 @@
 #!/usr/bin/python
 
-import stumpy
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
-from itertools import cycle, combinations
-from matplotlib.patches import Rectangle
-from scipy.cluster.hierarchy import linkage, dendrogram
-from scipy.special import comb
+from scipy.spatial.distance import cdist, pdist, squareform
 import glob
 import sys
 import os
 import getopt
+from corpus import open_corpus, read_records
+from prepare import prepare, clear_index
+from silence import silence
+import consensus
+import incremental
+from segments import Segments
+import instrument
+from cache import MAX_SIZE, Cache, key
+import plots
 
-def find(data_path, results_path, m):
-    data_files_pattern = '{}/*.csv'.format(data_path)
-    data_files = glob.glob(data_files_pattern)
+def load_series(data_files, corpus_path=None):
+    # a data file of many series (see corpus.read_records) gives all of them,
+    # named after their records, the others are named after the file
+    stems = {os.path.basename(f): os.path.splitext(os.path.basename(f))[0] for f in data_files}
+    if corpus_path is not None:
+        corpus = open_corpus(corpus_path, data_files)
+        return [stems.get(name, name) for name in corpus.names], [(fshapes, bases) for _, fshapes, bases, _ in corpus]
+    names = []
+    series = []
+    for f in data_files:
+        for name, fshapes, bases, _ in read_records(f):
+            names.append(name or stems[os.path.basename(f)])
+            series.append((fshapes, bases))
+    return names, series
 
-    Ts = [None] * len(data_files)
-    seq = [None] * len(data_files)
+def find(data_path, results_path, m, corpus_path=None, raw=False, threshold=1.0, debug=False, lengths=None, jobs=1, time_budget=None, max_candidates=None, no_plots=False, cache_path=None, cache_size=MAX_SIZE, update=False, top_k=None):
+    data_files_pattern = '{}/*.{}'.format(data_path, 'txt' if raw else 'csv')
+    data_files = glob.glob(data_files_pattern) if os.path.isdir(data_path) else [data_path]
+    cache = Cache(cache_path, cache_size) if cache_path else None
+    if update:
+        find_updated(data_files, results_path, m, raw, threshold, debug, jobs, no_plots, cache)
+        if cache is not None:
+            cache.evict()
+        return
+    with instrument.stage('read'):
+        names, series = load_series(data_files, corpus_path)
+        instrument.count('series', len(series))
+        instrument.count('nucleotides', sum(len(values) for values, _ in series))
+    if lengths:
+        find_lengths(names, series, lengths, results_path, raw, threshold, debug, jobs, no_plots, cache)
+    else:
+        if raw:
+            with instrument.stage('prepare'):
+                names, series = prepare(names, series, m, threshold, results_path if debug else None)
+        find_in_series(names, series, results_path, m, None, jobs, time_budget, max_candidates, no_plots, cache, top_k=top_k)
+    if cache is not None:
+        cache.evict()
+
+def find_lengths(names, series, lengths, results_path, raw=False, threshold=1.0, debug=False, jobs=1, no_plots=False, cache=None):
+    # the data is read once, prepared for every length in memory and scanned
+    # for all lengths together
+    indexes = {}
+    points = {}
+    with instrument.stage('prepare'):
+        for m in lengths:
+            if raw:
+                indexes[m] = [clear_index(silence(values, m, threshold), m) for values, _ in series]
+            else:
+                indexes[m] = [np.arange(len(values)) for values, _ in series]
+            points[m] = [np.isin(np.arange(len(values)), index if index is not None else []) for index, (values, _) in zip(indexes[m], series)]
+    with instrument.stage('scan'):
+        results = consensus.scan([values for values, _ in series], points, lengths)
+        instrument.count('lengths', len(lengths))
+        instrument.count('series', len(series))
+
+    summary = ['Length,Radius,Normalized-Radius,Sample,Range,Sequence']
+    best = None
+    for m in lengths:
+        if results[m] is None:
+            summary.append(f'{m},NA,NA,NA,NA,NA')
+            continue
+        radius, i, subseq_idx, active = results[m]
+        subseq_idx = int(np.flatnonzero(indexes[m][i] == subseq_idx)[0])
+        normalized_radius = radius / np.sqrt(m)
+        tseq = series[i][1][results[m][2] : results[m][2] + m].tobytes().decode()
+        summary.append(f'{m},{radius},{normalized_radius},{names[i]},{subseq_idx+1}-{subseq_idx+m+1},{tseq}')
+        if best is None or normalized_radius < best[0]:
+            best = normalized_radius, m, radius, i, subseq_idx, active
+    with open(os.path.join(results_path, 'conserved-motif-lengths.csv'), 'w') as fp:
+        fp.write('\n'.join(summary) + '\n')
+    print('\n'.join(summary))
+    if best is None:
+        print('No conserved motif found for any length.')
+        return
+
+    _, m, radius, i, subseq_idx, active = best
+    print(f'Best length: {m} (normalized radius {np.round(best[0], 4)})')
+    if raw:
+        with instrument.stage('prepare'):
+            names, series = prepare(names, series, m, threshold, results_path if debug else None)
+    else:
+        names, series = [names[k] for k in active], [series[k] for k in active]
+    find_in_series(names, series, results_path, m, (radius, list(active).index(i), subseq_idx), jobs, no_plots=no_plots, cache=cache)
+
+def find_updated(data_files, results_path, m, raw=False, threshold=1.0, debug=False, jobs=1, no_plots=False, cache=None):
+    # the results saved into results_path by the previous run with --update
+    # are updated for the data files added, changed or removed since
+    settings = {'version': incremental.VERSION, 'm': m, 'raw': raw, 'threshold': threshold if raw else None}
+    previous = incremental.load_state(results_path, settings)
+    if previous is None:
+        print('No saved state to update, searching all data files.')
+    state, best = incremental.update(data_files, m, raw, threshold, previous, results_path if debug else None)
+    if best is None:
+        print('No conserved motif found.')
+        return
+    find_in_series(state.names, state.series, results_path, m, best, jobs, no_plots=no_plots, cache=cache, state=state)
+
+def find_in_series(names, series, results_path, m, best=None, jobs=1, time_budget=None, max_candidates=None, no_plots=False, cache=None, state=None, top_k=None):
+    Ts = [None] * len(series)
+    seq = [None] * len(series)
 
     mmin = 1000.0
     mmax = -1000.0
-    for i, s in enumerate(data_files):
-      sample_df = pd.read_csv(s)
-      Ts[i] = sample_df["Reactivity"].iloc[:].values
-      seq[i] = sample_df["Sequence"].iloc[:].values
+    for i, (values, bases) in enumerate(series):
+      Ts[i] = values
+      seq[i] = bases
       current_min = np.nanargmin(Ts[i])
       if (Ts[i][current_min] < mmin):
         mmin = Ts[i][current_min]
@@ -35,149 +131,230 @@ def find(data_path, results_path, m):
     mmax = mmax + 0.2
     mmin = mmin - 0.2
 
+    # the search sees only the runs of defined values, windows over an
+    # undefined data point are never computed
+    segments = [Segments.from_series(T) for T in Ts]
     conserved_motifs_list = []
     
-    radius, Ts_idx, subseq_idx = stumpy.ostinato(Ts, m)
+    note = ''
+    if top_k is not None:
+        # the distances of the first search are kept for the next motifs, see
+        # find_more_motifs, so the conserved motif is not read from the cache
+        with instrument.stage('consensus'):
+            count_windows(segments, m)
+            search = consensus.TopConsensus(segments, m)
+            best = search.next()
+        if best is None:
+            print('No conserved motif found.')
+            return
+        best = best[:3]
+    # a search stopped early is not cached, it depends on the time it took
+    cached = cache is not None and best is None and time_budget is None and max_candidates is None
+    if cached:
+        ostinato_key = key('ostinato', m, *Ts)
+        saved = cache.get(ostinato_key)
+        if saved is not None:
+            best = float(saved['radius']), int(saved['series']), int(saved['subsequence'])
+            cached = False
+    if best is None:
+        # the consensus motif stumpy.ostinato finds, in parallel and/or anytime
+        with instrument.stage('ostinato'):
+            count_windows(segments, m)
+            best = consensus.ostinato(segments, m, jobs, time_budget, max_candidates)
+        if best is None:
+            print('No conserved motif found within the search budget.' if time_budget is not None or max_candidates is not None else 'No conserved motif found.')
+            return
+        radius, Ts_idx, subseq_idx, gap, searched = best
+        if searched < len(Ts):
+            note = f' The search stopped after {searched} of {len(Ts)} data files, the lowest radius possible is {np.round(radius - gap, 2)}.'
+            print(note.strip())
+        best = radius, Ts_idx, subseq_idx
+    radius, Ts_idx, subseq_idx = best
+    if cached:
+        cache.put(ostinato_key, radius=radius, series=Ts_idx, subsequence=subseq_idx)
     
-    tseq = '';
-    for a in range(m):
-        tseq = tseq + seq[Ts_idx][subseq_idx + a] 
+    tseq = seq[Ts_idx][subseq_idx : subseq_idx + m].tobytes().decode()
     
-    best_sample = data_files[Ts_idx].replace(os.path.join(data_path, ''),"").replace(".csv","")
-    conserved_motifs_list.append(f'Lowest radius ({np.round(radius, 2)}) found in location {subseq_idx+1}-{subseq_idx+m+1} of data file {best_sample} (seed motif sequence: {tseq}).')
+    best_sample = names[Ts_idx]
+    conserved_motifs_list.append(f'Lowest radius ({np.round(radius, 2)}) found in location {subseq_idx+1}-{subseq_idx+m+1} of data file {best_sample} (seed motif sequence: {tseq}).{note}')
     
     seed_motif = Ts[Ts_idx][subseq_idx : subseq_idx + m]
 
     save_conserved_motif(seed_motif, results_path, m)
-    nn = plot_motifs_alignment(plt, Ts, seq, Ts_idx, subseq_idx, seed_motif, data_files, m, data_path, results_path, conserved_motifs_list)
+    with instrument.stage('align_motifs'):
+        if state is not None:
+            state.seed_motif = seed_motif
+        known = state.known_alignments() if state is not None else {}
+        nn = align_motifs(Ts, segments, seq, Ts_idx, subseq_idx, seed_motif, names, m, conserved_motifs_list, cache, known)
+        instrument.count('motifs emitted', len(nn))
     save_conserved_motifs_list(results_path, conserved_motifs_list, m)
-    plot_clustering_dendrogram(plt, Ts, Ts_idx, data_files, m, data_path, results_path, nn, seed_motif)
-    plot_independent_motifs_matched_to_conserved_one(plt, Ts, data_path, data_files, m, results_path, nn, mmin, mmax)
+    with instrument.stage('aligned_motifs_distances'):
+        if state is not None and state.unchanged_seed():
+            dp = extend_aligned_motifs_distances(Ts, nn, m, state.previous.dp, state.origin)
+        else:
+            dp = aligned_motifs_distances(Ts, nn, m)
+        save_aligned_motifs_distances(results_path, names, dp, m)
+    if state is not None:
+        state.nn, state.dp = nn, dp
+        state.save(results_path)
+    if top_k is not None:
+        save_conserved_motif(seed_motif, results_path, m, 1)
+        save_conserved_motifs_list(results_path, conserved_motifs_list, m, 1)
+        with instrument.stage('find_more_motifs'):
+            find_more_motifs(search, Ts, seq, names, m, nn, top_k, results_path)
+    # the figures are drawn from the saved results, see plots.py
+    with instrument.stage('save_plot_data'):
+        plots.save_plot_data(results_path, m, names, Ts, nn, Ts_idx, mmin, mmax)
+    if not no_plots:
+        with instrument.stage('plots'):
+            plots.render(results_path, [m], jobs)
 
-def save_conserved_motif(seed_motif, results_path, m):
-    np.savetxt(os.path.join(results_path, f'conserved-motif-{m}.csv'), np.asarray(seed_motif), delimiter=",")
+def find_more_motifs(search, Ts, seq, names, m, nn, top_k, results_path):
+    # the motifs of rank 2 to top_k, each searched and aligned without the
+    # windows overlapping the motifs aligned to the ones before it
+    masked = [np.array(T, dtype=np.float64) for T in Ts]
+    for rank in range(2, top_k + 1):
+        search.exclude(nn)
+        for T, i in zip(masked, nn):
+            T[i : i + m] = np.nan
+        found = search.next()
+        if found is None or found[3] < 2:
+            print(f'No conserved motif of rank {rank} found, fewer than 2 data files have windows left.')
+            return
+        radius, Ts_idx, subseq_idx, active = found
+        tseq = seq[Ts_idx][subseq_idx : subseq_idx + m].tobytes().decode()
+        conserved_motifs_list = [f'Radius of rank {rank} ({np.round(radius, 2)}) found in location {subseq_idx+1}-{subseq_idx+m+1} of data file {names[Ts_idx]} (seed motif sequence: {tseq}), {active} data files have windows left.']
+        seed_motif = Ts[Ts_idx][subseq_idx : subseq_idx + m]
+        segments = [Segments.from_series(T) for T in masked]
+        aligned = []
+        nn = align_motifs(Ts, segments, seq, Ts_idx, subseq_idx, seed_motif, names, m, aligned)
+        # data files without a window left have no motif to list
+        others = [i for i in range(len(Ts)) if i != Ts_idx]
+        conserved_motifs_list += [line for i, line in zip(others, aligned) if len(segments[i].window_indices(m))]
+        instrument.count('motifs emitted', len(conserved_motifs_list) - 1)
+        save_conserved_motif(seed_motif, results_path, m, rank)
+        save_conserved_motifs_list(results_path, conserved_motifs_list, m, rank)
 
-def plot_motifs_alignment(plt, Ts, seq, Ts_idx, subseq_idx, seed_motif, data_files, m, data_path, results_path, conserved_motifs_list):
-    fig_size = plt.rcParams["figure.figsize"]
-    fig_size[0] = 20
-    fig_size[1] = 6
-    plt.rcParams["figure.figsize"] = fig_size
-    plt.rcParams['xtick.direction'] = 'out'
+def count_windows(segments, m):
+    # windows of the search, those over undefined data points are never formed
+    if not instrument.enabled():
+        return
+    instrument.count('series', len(segments))
+    for s in segments:
+        windows = len(s.window_indices(m))
+        instrument.count('windows', windows)
+        instrument.count('NaN windows skipped', max(len(s) - m + 1, 0) - windows)
 
-    plt.figure()
-    x = np.linspace(0,1,m)
+def save_conserved_motif(seed_motif, results_path, m, rank=None):
+    suffix = '' if rank is None else f'-{rank}'
+    np.savetxt(os.path.join(results_path, f'conserved-motif-{m}{suffix}.csv'), np.asarray(seed_motif), delimiter=",")
+
+def align_motifs(Ts, segments, seq, Ts_idx, subseq_idx, seed_motif, names, m, conserved_motifs_list, cache=None, known=None):
+    # the closest match of the seed motif in every data file, with a cache
+    # only the data files not aligned to the same seed motif before, `known`
+    # maps data files to their alignments kept by an incremental update
+    aligned = {}
+    if cache is not None:
+        alignment_key = key('alignment', seed_motif, m)
+        series_keys = [key('series', T) for T in Ts]
+        saved = cache.get(alignment_key)
+        if saved is not None:
+            aligned = dict(zip(saved['series'], saved['nn']))
     nn = np.zeros(len(Ts), dtype=np.int64)
     nn[Ts_idx] = subseq_idx
-    for i, e in enumerate(Ts):
+    for i in range(len(Ts)):
         if i != Ts_idx:
-            nn[i] = np.argmin(stumpy.core.mass(seed_motif, e))
-            lw = 1
-            label = None
-            oseq = '';
-            for a in range(m):
-                val = seq[i][nn[i] + a]
-                if isinstance(val, float) and np.isnan(val):
-                    oseq = oseq + 'N'
-                else:
-                    oseq = oseq + val
-            current_sample = data_files[i].replace(os.path.join(data_path, ''),"").replace(".csv","")            
+            if known and i in known:
+                nn[i] = known[i]
+            elif cache is not None and series_keys[i] in aligned:
+                nn[i] = aligned[series_keys[i]]
+            else:
+                nn[i] = consensus.best_match(segments[i], seed_motif)
+                instrument.count('motifs aligned')
+            oseq = seq[i][nn[i] : nn[i] + m].tobytes().decode()
+            current_sample = names[i]
             conserved_motifs_list.append(f'{current_sample}: {oseq} {nn[i]+1}-{nn[i]+m+1}')
-        else:
-            lw = 4
-            label = 'Seed Motif'
-        plt.plot(x, e[nn[i]:nn[i]+m], lw=lw, label=label)
-    plt.title('All Motifs Alignment (fSHAPE)')
-    plt.xlabel(f'Motif sequence (w = {m} nts)')
-    plt.ylabel('Reactivity')
-    plt.legend()
-    plt.savefig(os.path.join(results_path, f'all-motifs-alignment-{m}.png'))
-    plt.close()
+    if cache is not None:
+        cache.put(alignment_key, series=np.array(series_keys), nn=nn)
     return nn
 
-def save_conserved_motifs_list(results_path, conserved_motifs_list, m):
-    with open(os.path.join(results_path, f'all-motifs-list-{m}.txt'), 'w') as fp:
+def save_conserved_motifs_list(results_path, conserved_motifs_list, m, rank=None):
+    suffix = '' if rank is None else f'-{rank}'
+    with open(os.path.join(results_path, f'all-motifs-list-{m}{suffix}.txt'), 'w') as fp:
         fp.write('\n'.join(conserved_motifs_list))
 
-def get_map_of_data_points(data_files, data_path):
-    data = {}
-    for i, s in enumerate(data_files):
-        data_file = s.replace(os.path.join(data_path, ''),"").replace(".csv","")    
-        data[data_file] = i
-    return data
-    
-def plot_clustering_dendrogram(plt, Ts, Ts_idx, data_files, m, data_path, results_path, nn, seed_motif):
-    data = get_map_of_data_points(data_files, data_path)
-    
-    fig_size = plt.rcParams["figure.figsize"]
-    fig_size[1] = 4 * 10
-    plt.rcParams["figure.figsize"] = fig_size
-
-    plt.figure()
-    fig, ax = plt.subplots()
-    seed_name = data_files[Ts_idx].replace(os.path.join(data_path, ''),"").replace(".csv","")
-    dp = np.zeros(int(comb(len(data), 2)))
-    for i, a_c in enumerate(combinations(data.keys(), 2)):
-        if seed_name == a_c[0]:
-            other_idx = data[a_c[1]]
-            other_motif = Ts[other_idx][nn[other_idx] : nn[other_idx] + m]
-            dp[i] = stumpy.core.mass(seed_motif, other_motif)
-        elif seed_name == a_c[1]:
-            other_idx = data[a_c[0]]
-            other_motif = Ts[other_idx][nn[other_idx] : nn[other_idx] + m]
-            dp[i] = stumpy.core.mass(other_motif, seed_motif)
-        else:
-            first_idx = data[a_c[0]]
-            first_motif = Ts[first_idx][nn[first_idx] : nn[first_idx] + m]
-            second_idx = data[a_c[1]]
-            second_motif = Ts[second_idx][nn[second_idx] : nn[second_idx] + m]
-            dp[i] = stumpy.core.mass(first_motif, second_motif)
-    Z = linkage(dp, optimal_ordering=True)
-    dendrogram(Z, labels=[k for k in data.keys()], ax=ax)
-    plt.ylabel('Z-Normalized Euclidean Distance')
-    plt.title(f'Clustering (w = {m} nts)')
-    plt.savefig(os.path.join(results_path, f'aligned-motifs-clustering-dendrogram-{m}.png'))
-    plt.close()
-
-def plot_independent_motifs_matched_to_conserved_one(plt, Ts, data_path, data_files, m, results_path, nn, mmin, mmax):
-    fig_size = plt.rcParams["figure.figsize"]
-    fig_size[1] = 10 * 20
-    plt.rcParams["figure.figsize"] = fig_size
-
-    plt.figure()
-    ax = plot_vertical_signals(plt, Ts, data_path, data_files, m, mmin, mmax)
-    for i in range(len(Ts)):
-        y = ax[i].get_ylim()
-        r = Rectangle((nn[i] / m, y[0]), 1, y[1]-y[0], alpha=0.3)
-        ax[i].add_patch(r)
-    plt.suptitle('fSHAPE', fontsize=14)
-    plt.savefig(os.path.join(results_path, f'all-motifs-presented-independently-{m}.png'))
-    plt.close()
-
-def plot_vertical_signals(plt, Ts, data_path, data_files, m, mmin, mmax):
-    fig, ax = plt.subplots(len(Ts), sharex=True, sharey=True)
-    prop_cycle = plt.rcParams['axes.prop_cycle']
-    colors = cycle(prop_cycle.by_key()['color'])
-    for i, e in enumerate(Ts):
-        ax[i].plot(np.arange(0, len(e)) / m, e, color=next(colors), label=data_files[i].replace(os.path.join(data_path, ''),"").replace(".csv",""))
-        ax[i].set_ylim((mmin, mmax))
-        ax[i].legend()
-        ax[i].set_ylabel('Reactivity')
-    plt.subplots_adjust(hspace=0)
-    plt.xlabel(f'Sequence split by motif length used (w = {m} nts)')
-    return ax
+def aligned_motifs_distances(Ts, nn, m):
+    """Condensed matrix of the z-normalized Euclidean distances between the aligned motifs.
+
+    Pairs are in the order of scipy.spatial.distance.pdist. Constant motifs are
+    at 0 from each other and at sqrt(m) from all others, as in stumpy. Motifs
+    with NaN have no z-normalized distance, they are put at the largest one
+    possible, 2 * sqrt(m), from all other motifs.
+    """
+    Z, undefined = normalized_motifs(Ts, nn, m)
+    dp = pdist(Z)
+    n = len(Ts)
+    for i in np.flatnonzero(undefined):
+        others = np.delete(np.arange(n), i)
+        first, second = np.minimum(others, i), np.maximum(others, i)
+        dp[n * first - first * (first + 1) // 2 + second - first - 1] = 2 * np.sqrt(m)
+    return dp
+
+def normalized_motifs(Ts, nn, m):
+    # z-normalized aligned motifs, constant and undefined ones all zeros
+    motifs = np.array([T[i : i + m] for T, i in zip(Ts, nn)], dtype=np.float64).reshape(len(Ts), m)
+    undefined = np.isnan(motifs).any(axis=1)
+    constant = ~undefined & (np.ptp(motifs, axis=1) == 0)
+    motifs[undefined] = 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        Z = (motifs - motifs.mean(axis=1, keepdims=True)) / motifs.std(axis=1, keepdims=True)
+    Z[constant | undefined] = 0
+    return Z, undefined
+
+def extend_aligned_motifs_distances(Ts, nn, m, dp, origin):
+    """aligned_motifs_distances with the distances between the motifs of a previous run taken from its matrix dp.
+
+    origin[i] is the index of motif i in the previous run, or -1 for a new
+    motif, only the distances of the new motifs are computed.
+    """
+    Z, undefined = normalized_motifs(Ts, nn, m)
+    kept = np.flatnonzero(origin >= 0)
+    added = np.flatnonzero(origin < 0)
+    D = np.zeros((len(Ts), len(Ts)))
+    D[np.ix_(kept, kept)] = squareform(dp)[np.ix_(origin[kept], origin[kept])]
+    D[added] = cdist(Z[added], Z)
+    D[:, added] = D[added].T
+    D[undefined] = 2 * np.sqrt(m)
+    D[:, undefined] = 2 * np.sqrt(m)
+    np.fill_diagonal(D, 0)
+    return squareform(D, checks=False)
+
+def save_aligned_motifs_distances(results_path, names, dp, m):
+    np.savez(os.path.join(results_path, f'aligned-motifs-distances-{m}.npz'), names=np.array(names), distances=dp)
+
+USAGE = 'find-conserved-motifs.py -i <input_data_path> (required) -r <results_path> (required) -l <expected_motif_length>  (required) -c <corpus_path> (optional) -p (optional, prepare raw *.txt input data in memory) -t <threshold> (optional, default 1.0) -d (optional, write prepared data into results_path) --lengths <first>-<last> (optional, scan all these motif lengths instead of -l) -j <jobs> (optional, parallel search) --time-budget <seconds> (optional) --max-candidates <data files> (optional) --no-plots (optional, save the results without drawing the figures) --plots-only (optional, only draw the figures of the results saved in results_path) --run-report (optional, write run-report.json into results_path) --run-summary (optional, like --run-report and print a summary to stderr) --cache <cache_path> (optional) --cache-size <megabytes> (optional, default 1024) --update (optional, update the results saved into results_path for the data files added, changed or removed since) --top-k <k> (optional, also find the next best conserved motifs, up to k, each without the windows aligned to the motifs before it)'
+
+def parse_lengths(arg):
+    # "6-15", "13" or "6,8,10-12"
+    lengths = set()
+    for part in arg.split(','):
+        first, _, last = part.partition('-')
+        lengths.update(range(int(first), int(last or first) + 1))
+    return sorted(lengths)
 
 def read_config(argv):
     try:
-        opts, args = getopt.getopt(argv,"hi:r:l:",["input_data_path=","results_path=","expected_motif_length="])
+        opts, args = getopt.getopt(argv,"hi:r:l:c:pt:dj:",["input_data_path=","results_path=","expected_motif_length=","corpus_path=","prepare","threshold=","debug","lengths=","jobs=","time-budget=","max-candidates=","no-plots","plots-only","run-report","run-summary","cache=","cache-size=","update","top-k="])
     except getopt.GetoptError:
-        print('find-conserved-motifs.py -i <input_data_path> (required) -r <results_path> (required) -l <expected_motif_length>  (required)')
+        print(USAGE)
         sys.exit(1)
     results_path = "./results/hnrnpa2b1_binding_sites_fshape/13"
     expected_motif_length = 13
+    options = {}
     required_arguments_count = 0
     for opt, arg in opts:
         if opt == '-h':
-            print('find-conserved-motifs.py -i <input_data_path> (required) -r <results_path> (required) -l <expected_motif_length>  (required)')
+            print(USAGE)
             sys.exit(0)
         elif opt in ("-i", "--input_data_path"):
             input_data_path = arg
@@ -188,17 +365,74 @@ def read_config(argv):
         elif opt in ("-l", "--expected_motif_length"):
             expected_motif_length = int(arg)
             required_arguments_count = required_arguments_count + 1
+        elif opt in ("-c", "--corpus_path"):
+            options['corpus_path'] = arg
+        elif opt in ("-p", "--prepare"):
+            options['raw'] = True
+        elif opt in ("-t", "--threshold"):
+            options['threshold'] = float(arg)
+        elif opt in ("-d", "--debug"):
+            options['debug'] = True
+        elif opt == "--lengths":
+            options['lengths'] = parse_lengths(arg)
+            expected_motif_length = options['lengths'][-1]
+            required_arguments_count = required_arguments_count + 1
+        elif opt in ("-j", "--jobs"):
+            options['jobs'] = int(arg)
+        elif opt == "--time-budget":
+            options['time_budget'] = float(arg)
+        elif opt == "--max-candidates":
+            options['max_candidates'] = int(arg)
+        elif opt == "--no-plots":
+            options['no_plots'] = True
+        elif opt == "--plots-only":
+            options['plots_only'] = True
+        elif opt == "--run-report":
+            options['run_report'] = True
+        elif opt == "--run-summary":
+            options['run_report'] = options['run_summary'] = True
+        elif opt == "--cache":
+            options['cache_path'] = arg
+        elif opt == "--cache-size":
+            options['cache_size'] = float(arg)
+        elif opt == "--update":
+            options['update'] = True
+        elif opt == "--top-k":
+            options['top_k'] = int(arg)
+    if options.get('plots_only'):
+        return None, results_path, expected_motif_length, options
     if required_arguments_count != 3:
-        print('find-conserved-motifs.py -i <input_data_path> (required) -r <results_path> (required) -l <expected_motif_length>  (required)')
+        print(USAGE)
+        sys.exit(1)
+    if options.get('update') and 'lengths' in options:
+        print('--update works with a single motif length (-l) only')
+        sys.exit(1)
+    if 'top_k' in options and (options['top_k'] < 1 or options.get('update') or 'lengths' in options or 'time_budget' in options or 'max_candidates' in options):
+        print('--top-k takes a positive number and cannot be combined with --lengths, --update, --time-budget or --max-candidates')
         sys.exit(1)
-    return input_data_path, results_path, expected_motif_length
+    return input_data_path, results_path, expected_motif_length, options
 
 def find_conserved_motifs(argv):
-    input_data_path, results_path, expected_motif_length = read_config(argv)
+    input_data_path, results_path, expected_motif_length, options = read_config(argv)
+    summary = options.pop('run_summary', False)
+    if options.pop('run_report', False):
+        instrument.enable()
+    if options.pop('plots_only', False):
+        print('Results path: {}'.format(results_path))
+        with instrument.stage('plots'):
+            plots.render(results_path, plots.saved_lengths(results_path), options.get('jobs', 1))
+        instrument.save(results_path, summary)
+        return
     print('Input data path: {}'.format(input_data_path))
-    print('Expected motif length: {}'.format(expected_motif_length))
+    if 'lengths' not in options:
+        print('Expected motif length: {}'.format(expected_motif_length))
+    else:
+        print('Expected motif lengths: {}-{}'.format(options['lengths'][0], options['lengths'][-1]))
     print('Results path: {}'.format(results_path))
-    find(input_data_path, results_path, expected_motif_length)
+    if 'corpus_path' in options:
+        print('Corpus path: {}'.format(options['corpus_path']))
+    find(input_data_path, results_path, expected_motif_length, **options)
+    instrument.save(results_path, summary)
 
 def main(argv):
     find_conserved_motifs(argv)
@@ -0,0 +1,163 @@
+#!/usr/bin/python
+
+import json
+import os
+import numpy as np
+from corpus import file_hash, read_records
+from prepare import prepare
+import consensus
+import instrument
+from segments import Segments
+
+VERSION = 3
+
+def state_path(results_path, m):
+    return os.path.join(results_path, f'incremental-{m}.npz')
+
+class State:
+    """What a search of length m leaves to the next one on a changed set of data files.
+
+    `digests` maps the name of every data file read to a hash of its content,
+    `names` and `series` are the prepared series kept, in the order of the data
+    files, `sources` names the data file of every series (a data file may hold
+    many, see corpus.read_records), and `nns` holds the distance from every window of their runs of
+    defined values to its nearest neighbor in every series (see
+    consensus.nearest_neighbor_distances), one row per defined value.
+    The seed motif, the alignment `nn` and the condensed distance matrix `dp` of
+    the aligned motifs are set once the search is done. `origin` gives, for
+    every series, its index in the previous state or -1 if it is new.
+    """
+
+    def __init__(self, settings, digests, names, series, sources, nns, seed_motif=None, nn=None, dp=None):
+        self.settings = settings
+        self.digests = digests
+        self.names = names
+        self.series = series
+        self.sources = sources
+        self.nns = nns
+        self.seed_motif = seed_motif
+        self.nn = nn
+        self.dp = dp
+        self.previous = None
+        self.origin = np.full(len(series), -1, dtype=np.int64)
+
+    def offsets(self):
+        return np.concatenate(([0], np.cumsum([len(values) for values, _ in self.series], dtype=np.int64)))
+
+    def rows(self):
+        # the rows of every series in nns
+        return np.concatenate(([0], np.cumsum([np.isfinite(values).sum() for values, _ in self.series], dtype=np.int64)))
+
+    def save(self, results_path):
+        values = np.concatenate([values for values, _ in self.series] + [np.empty(0)])
+        bases = np.concatenate([bases for _, bases in self.series] + [np.empty(0, 'S1')])
+        path = state_path(results_path, self.settings['m'])
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, settings=json.dumps(self.settings), files=np.array(list(self.digests)), digests=np.array(list(self.digests.values())), names=np.array(self.names), sources=np.array(self.sources), offsets=self.offsets(), values=values, bases=bases, nns=self.nns, seed_motif=self.seed_motif, nn=self.nn, dp=self.dp)
+        os.replace(path + '.tmp', path)
+
+    def unchanged_seed(self):
+        # the alignments and distances of the previous state still hold
+        previous = self.previous
+        return previous is not None and previous.seed_motif is not None and np.array_equal(previous.seed_motif, self.seed_motif, equal_nan=True)
+
+    def known_alignments(self):
+        """{series index: start of its aligned motif} kept from the previous state."""
+        if not self.unchanged_seed():
+            return {}
+        return {i: int(self.previous.nn[k]) for i, k in enumerate(self.origin) if k >= 0}
+
+def load_state(results_path, settings):
+    """The state saved into results_path by a search with the same settings, or None."""
+    try:
+        with np.load(state_path(results_path, settings['m'])) as data:
+            if json.loads(str(data['settings'])) != settings:
+                return None
+            offsets = data['offsets']
+            values, bases = data['values'], data['bases']
+            series = [(values[start:end], bases[start:end]) for start, end in zip(offsets, offsets[1:])]
+            return State(settings, dict(zip(data['files'], data['digests'])), list(data['names']), series, list(data['sources']), data['nns'], data['seed_motif'], data['nn'], data['dp'])
+    except (OSError, ValueError, KeyError):
+        return None
+
+def update(data_files, m, raw=False, threshold=1.0, previous=None, debug_path=None):
+    """The state of the search on `data_files`, updated from a previous one, and the consensus motif.
+
+    Only the data files new or changed since the previous state are read and
+    prepared, and only the nearest neighbor distances from and to their series
+    are computed. The consensus motif is picked from all distances the way
+    consensus.scan picks it, so it is the one of a full search. Returns the
+    state and (radius, series index, subsequence index), or None if there is no
+    valid window.
+    """
+    settings = {'version': VERSION, 'm': m, 'raw': raw, 'threshold': threshold if raw else None}
+    files = [os.path.basename(f) for f in data_files]
+    digests = dict(zip(files, (file_hash(f) for f in data_files)))
+    with instrument.stage('update'):
+        # the series of the data files unchanged since the previous state
+        kept = {}
+        if previous is not None:
+            for file in files:
+                if previous.digests.get(file) == digests[file]:
+                    kept[file] = [k for k, source in enumerate(previous.sources) if source == file]
+            instrument.count('data files removed', len(set(previous.digests) - set(files)))
+        instrument.count('data files unchanged', len(kept))
+        fresh = {}
+        for f, file in zip(data_files, files):
+            if file in kept:
+                continue
+            with instrument.stage('read'):
+                record_names = []
+                record_series = []
+                for name, fshapes, bases, _ in read_records(f):
+                    record_names.append(name or os.path.splitext(file)[0])
+                    record_series.append((fshapes, bases))
+            if raw:
+                with instrument.stage('prepare'):
+                    record_names, record_series = prepare(record_names, record_series, m, threshold, debug_path)
+            fresh[file] = list(zip(record_names, record_series))
+        instrument.count('data files added or changed', len(fresh))
+
+    names = []
+    series = []
+    sources = []
+    origin = []
+    for file in files:
+        for name, values in fresh.get(file, []):
+            names.append(name)
+            series.append(values)
+            sources.append(file)
+            origin.append(-1)
+        for k in kept.get(file, []):
+            names.append(previous.names[k])
+            series.append(previous.series[k])
+            sources.append(file)
+            origin.append(k)
+    origin = np.array(origin, dtype=np.int64)
+
+    joined = consensus.Series([Segments.from_series(values) for values, _ in series])
+    statistics = joined.statistics(m, joined.finite)
+    nns = np.full((len(joined), len(series)), np.inf)
+    old = np.flatnonzero(origin >= 0)
+    new = np.flatnonzero(origin < 0)
+    if len(old):
+        previous_rows = previous.rows()
+        for i in old:
+            rows = previous.nns[previous_rows[origin[i]] : previous_rows[origin[i] + 1]]
+            nns[joined.offsets[i] : joined.offsets[i + 1], old] = rows[:, origin[old]]
+    with instrument.stage('nearest_neighbors'):
+        if len(new):
+            instrument.count('windows', len(joined.positions(new)))
+            nns[np.ix_(joined.positions(old), new)] = consensus.series_nearest_neighbor_distances(joined, statistics, m, old, new)
+            nns[joined.positions(new)] = consensus.series_nearest_neighbor_distances(joined, statistics, m, new, range(len(series)))
+
+    state = State(settings, digests, names, series, sources, nns)
+    state.previous = previous
+    state.origin = origin
+    with instrument.stage('consensus'):
+        result = consensus.consensus(joined, nns, statistics, m) if len(joined) else None
+    if result is None:
+        return state, None
+    radius, start, _ = result
+    i = int(joined.owner[start])
+    return state, (radius, i, int(joined.position[start]))
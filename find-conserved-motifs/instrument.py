@@ -0,0 +1 @@
+../find-query/instrument.py
\ No newline at end of file
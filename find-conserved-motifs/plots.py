@@ -0,0 +1,157 @@
+#!/usr/bin/python
+
+import glob
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import cycle
+import numpy as np
+from scipy.cluster.hierarchy import linkage, dendrogram
+import instrument
+
+# the independent motifs figure has one row per data file, it is split into
+# pages of this many rows
+SERIES_PER_PAGE = 20
+ROW_HEIGHT = 3
+# larger dendrograms only show the last merges
+MAX_LEAVES = 100
+
+def pyplot():
+    # imported only by the processes which draw
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+def save_plot_data(results_path, m, names, Ts, nn, Ts_idx, mmin, mmax):
+    """Save what the figures of length m show, they are drawn from it by render."""
+    offsets = np.concatenate(([0], np.cumsum([len(T) for T in Ts], dtype=np.int64)))
+    np.savez(os.path.join(results_path, f'plots-{m}.npz'), names=np.array(names), offsets=offsets, values=np.concatenate(Ts), nn=nn, seed=Ts_idx, limits=[mmin, mmax])
+
+def load_plot_data(results_path, m):
+    data = np.load(os.path.join(results_path, f'plots-{m}.npz'))
+    offsets = data['offsets']
+    Ts = [data['values'][start:end] for start, end in zip(offsets, offsets[1:])]
+    mmin, mmax = data['limits']
+    return list(data['names']), Ts, data['nn'], int(data['seed']), mmin, mmax
+
+def load_aligned_motifs_distances(results_path, m):
+    data = np.load(os.path.join(results_path, f'aligned-motifs-distances-{m}.npz'))
+    return list(data['names']), data['distances']
+
+def saved_lengths(results_path):
+    paths = glob.glob(os.path.join(results_path, 'plots-*.npz'))
+    return sorted(int(re.fullmatch(r'plots-(\d+)\.npz', os.path.basename(p)).group(1)) for p in paths)
+
+def plot_motifs_alignment(results_path, m):
+    plt = pyplot()
+    names, Ts, nn, Ts_idx, mmin, mmax = load_plot_data(results_path, m)
+    plt.rcParams['xtick.direction'] = 'out'
+
+    plt.figure(figsize=(20, 6))
+    x = np.linspace(0,1,m)
+    for i, e in enumerate(Ts):
+        if i != Ts_idx:
+            lw = 1
+            label = None
+        else:
+            lw = 4
+            label = 'Seed Motif'
+        plt.plot(x, e[nn[i]:nn[i]+m], lw=lw, label=label)
+    plt.title('All Motifs Alignment (fSHAPE)')
+    plt.xlabel(f'Motif sequence (w = {m} nts)')
+    plt.ylabel('Reactivity')
+    plt.legend()
+    plt.savefig(os.path.join(results_path, f'all-motifs-alignment-{m}.png'))
+    plt.close()
+
+def plot_clustering_dendrogram(results_path, m):
+    names, dp = load_aligned_motifs_distances(results_path, m)
+    if len(names) < 2:
+        return
+    plt = pyplot()
+
+    fig, ax = plt.subplots(figsize=(20, 4 * 10))
+    Z = linkage(dp, optimal_ordering=True)
+    if len(names) > MAX_LEAVES:
+        # the leaves are the clusters left, labelled with their sizes
+        dendrogram(Z, truncate_mode='lastp', p=MAX_LEAVES, ax=ax)
+    else:
+        dendrogram(Z, labels=names, ax=ax)
+    plt.ylabel('Z-Normalized Euclidean Distance')
+    plt.title(f'Clustering (w = {m} nts)')
+    plt.savefig(os.path.join(results_path, f'aligned-motifs-clustering-dendrogram-{m}.png'))
+    plt.close(fig)
+
+def pages(n):
+    return max(1, -(-n // SERIES_PER_PAGE))
+
+def independent_motifs_path(results_path, m, page, n):
+    if pages(n) == 1:
+        return os.path.join(results_path, f'all-motifs-presented-independently-{m}.png')
+    return os.path.join(results_path, f'all-motifs-presented-independently-{m}-page-{page + 1}.png')
+
+def plot_independent_motifs_matched_to_conserved_one(results_path, m, page=0):
+    from matplotlib.patches import Rectangle
+    plt = pyplot()
+    names, Ts, nn, Ts_idx, mmin, mmax = load_plot_data(results_path, m)
+    rows = range(page * SERIES_PER_PAGE, min((page + 1) * SERIES_PER_PAGE, len(Ts)))
+
+    fig, ax = plot_vertical_signals(plt, Ts, names, m, mmin, mmax, rows)
+    for k, i in enumerate(rows):
+        y = ax[k].get_ylim()
+        r = Rectangle((nn[i] / m, y[0]), 1, y[1]-y[0], alpha=0.3)
+        ax[k].add_patch(r)
+    title = 'fSHAPE' if pages(len(Ts)) == 1 else f'fSHAPE ({page + 1}/{pages(len(Ts))})'
+    plt.suptitle(title, fontsize=14)
+    plt.savefig(independent_motifs_path(results_path, m, page, len(Ts)))
+    plt.close(fig)
+
+def plot_vertical_signals(plt, Ts, names, m, mmin, mmax, rows):
+    fig, ax = plt.subplots(len(rows), sharex=True, sharey=True, squeeze=False, figsize=(20, ROW_HEIGHT * len(rows)))
+    ax = ax[:, 0]
+    prop_cycle = plt.rcParams['axes.prop_cycle']
+    colors = cycle(prop_cycle.by_key()['color'])
+    # the colors continue from the previous page
+    for _ in range(rows.start % len(prop_cycle)):
+        next(colors)
+    for k, i in enumerate(rows):
+        e = Ts[i]
+        ax[k].plot(np.arange(0, len(e)) / m, e, color=next(colors), label=names[i])
+        ax[k].set_ylim((mmin, mmax))
+        ax[k].legend()
+        ax[k].set_ylabel('Reactivity')
+    if pages(len(Ts)) > 1:
+        # all pages have the same scale
+        ax[0].set_xlim((0, max(len(T) for T in Ts) / m))
+    # margins of a fixed size, the rows take the rest of the page
+    height = ROW_HEIGHT * len(rows)
+    plt.subplots_adjust(hspace=0, top=1 - 0.8 / height, bottom=0.6 / height)
+    plt.xlabel(f'Sequence split by motif length used (w = {m} nts)')
+    return fig, ax
+
+def render(results_path, lengths, jobs=1):
+    """Draw the figures of every length in `lengths` from the saved results.
+
+    Every figure, and every page of the independent motifs figure, is drawn by
+    a separate task, by `jobs` processes.
+    """
+    tasks = []
+    for m in lengths:
+        n = len(load_plot_data(results_path, m)[0])
+        tasks.append((plot_motifs_alignment, results_path, m))
+        tasks.append((plot_clustering_dendrogram, results_path, m))
+        tasks.extend((plot_independent_motifs_matched_to_conserved_one, results_path, m, page) for page in range(pages(n)))
+    instrument.count('figures', len(tasks))
+    if jobs <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            draw(task)
+        return
+    # the workers are started fresh, forking a process which ran numba code
+    # (stumpy) leaves it hanging at exit
+    with ProcessPoolExecutor(min(jobs, len(tasks)), mp_context=multiprocessing.get_context('spawn')) as pool:
+        list(pool.map(draw, tasks))
+
+def draw(task):
+    task[0](*task[1:])
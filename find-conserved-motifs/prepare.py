@@ -0,0 +1,110 @@
+#!/usr/bin/python
+
+import sys
+import numpy as np
+import glob
+import getopt
+import os
+from corpus import read_series
+from silence import silence, write_series
+import instrument
+
+USAGE = 'prepare.py -i <input_data_path> (required) -r <results_path> (required) -l <expected_motif_length>  (required) -t <threshold> (optional, default 1.0)'
+
+def clear_index(values, expected_motif_length):
+    # keep only the runs of defined values at least expected_motif_length long,
+    # separated by a single undefined data point (index -1)
+    edges = np.diff(np.concatenate(([0], (~np.isnan(values)).astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    keep = ends - starts >= expected_motif_length
+    starts, ends = starts[keep], ends[keep]
+    if len(starts) == 0:
+        return None
+    return np.concatenate([np.append(np.arange(s, e), -1) for s, e in zip(starts, ends)])[:-1]
+
+def clear(values, bases, expected_motif_length):
+    index = clear_index(values, expected_motif_length)
+    if index is None:
+        return None
+    separator = index < 0
+    values = np.where(separator, np.nan, values[index])
+    bases = np.where(separator, b'N', bases[index])
+    return values, bases
+
+def prepare(names, series, expected_motif_length, threshold=1.0, debug_path=None):
+    """Silence and clear the (values, bases) series in memory.
+
+    Returns the names and series left, series without any data point that may
+    be part of a motif are dropped. With debug_path the parsed series are
+    written into debug_path/orig and the prepared ones into
+    debug_path/<expected_motif_length>.
+    """
+    if debug_path is not None:
+        orig_path = os.path.join(debug_path, 'orig')
+        prepared_path = os.path.join(debug_path, str(expected_motif_length))
+        os.makedirs(orig_path, exist_ok=True)
+        os.makedirs(prepared_path, exist_ok=True)
+    prepared_names = []
+    prepared = []
+    for name, (values, bases) in zip(names, series):
+        if debug_path is not None:
+            write_series(os.path.join(orig_path, name + '.csv'), values, bases)
+        with instrument.stage('silence'):
+            silenced = silence(values, expected_motif_length, threshold)
+        with instrument.stage('clear'):
+            cleared = clear(silenced, bases, expected_motif_length)
+        if cleared is None:
+            instrument.count('series dropped')
+            continue
+        if debug_path is not None:
+            write_series(os.path.join(prepared_path, name + '.csv'), *cleared)
+        prepared_names.append(name)
+        prepared.append(cleared)
+    return prepared_names, prepared
+
+def read_config(argv):
+    try:
+        opts, args = getopt.getopt(argv,"hi:r:l:t:",["input_data_path=","results_path=","expected_motif_length=","threshold="])
+    except getopt.GetoptError:
+        print(USAGE)
+        sys.exit(1)
+    results_path = "./results/hnrnpa2b1_binding_sites_fshape"
+    expected_motif_length = 13
+    threshold = 1.0
+    required_arguments_count = 0
+    for opt, arg in opts:
+        if opt == '-h':
+            print(USAGE)
+            sys.exit(0)
+        elif opt in ("-i", "--input_data_path"):
+            input_data_path = arg
+            required_arguments_count = required_arguments_count + 1
+        elif opt in ("-r", "--results_path"):
+            results_path = arg
+            required_arguments_count = required_arguments_count + 1
+        elif opt in ("-l", "--expected_motif_length"):
+            expected_motif_length = int(arg)
+            required_arguments_count = required_arguments_count + 1
+        elif opt in ("-t", "--threshold"):
+            threshold = float(arg)
+    if required_arguments_count != 3:
+        print(USAGE)
+        sys.exit(1)
+    return input_data_path, results_path, expected_motif_length, threshold
+
+def prepare_data_set(argv):
+    input_data_path, results_path, expected_motif_length, threshold = read_config(argv)
+    print('Input data path: {}'.format(input_data_path))
+    print('Expected motif length: {}'.format(expected_motif_length))
+    print('Results path: {}'.format(results_path))
+
+    data_files = glob.glob('{}/*.txt'.format(input_data_path))
+    names = [os.path.splitext(os.path.basename(f))[0] for f in data_files]
+    prepare(names, [read_series(f)[:2] for f in data_files], expected_motif_length, threshold, results_path)
+
+def main(argv):
+    prepare_data_set(argv)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
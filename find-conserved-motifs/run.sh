@@ -2,13 +2,15 @@
 
 PATH_TO_INPUT_DATA_SET="./input_data_set/hnrnpa2b1_binding_sites_fshape"
 EXPECTED_MOTIF_LENGTH=13
+MOTIF_LENGTHS=""
+DEBUG=""
 
 show_help() {                                 # Function: Print a help message.
-  echo "Usage: $0 [ -i PATH_TO_INPUT_DATA_SET ] [ -l EXPECTED_MOTIF_LENGTH ]" 1>&2 
+  echo "Usage: $0 [ -i PATH_TO_INPUT_DATA_SET ] [ -l EXPECTED_MOTIF_LENGTH | -L MOTIF_LENGTHS ] [ -d ]" 1>&2 
   exit 1
 }
 
-while getopts ":i:l:" options; do
+while getopts ":i:l:L:d" options; do
   case "${options}" in
     i)                
       PATH_TO_INPUT_DATA_SET=${OPTARG}  
@@ -16,6 +18,12 @@ while getopts ":i:l:" options; do
     l)                
       EXPECTED_MOTIF_LENGTH=${OPTARG}  
       ;;
+    L)
+      MOTIF_LENGTHS=${OPTARG}
+      ;;
+    d)
+      DEBUG="-d"
+      ;;
     :)
       echo "Error: -${OPTARG} requires an argument."
       show_help
@@ -40,10 +48,11 @@ if [[ -d $RESULTS_PATH/$INPUT_NAME ]]; then
 	rm -r $RESULTS_PATH/$INPUT_NAME
 fi
 mkdir $RESULTS_PATH/$INPUT_NAME
-echo "Transform and clean data..."
-./transform.sh -i $INPUT_DATA_SET_PATH -r $RESULTS_PATH/$INPUT_NAME -l $EXPECTED_MOTIF_LENGTH
-echo "Done."
-echo "Find conserved motifs..."
-python find-conserved-motifs.py -i $RESULTS_PATH/$INPUT_NAME/$EXPECTED_MOTIF_LENGTH -r $RESULTS_PATH/$INPUT_NAME -l 13
+echo "Prepare data and find conserved motifs..."
+if [[ -n $MOTIF_LENGTHS ]]; then
+	python find-conserved-motifs.py -i $INPUT_DATA_SET_PATH -r $RESULTS_PATH/$INPUT_NAME --lengths $MOTIF_LENGTHS -p $DEBUG
+else
+	python find-conserved-motifs.py -i $INPUT_DATA_SET_PATH -r $RESULTS_PATH/$INPUT_NAME -l $EXPECTED_MOTIF_LENGTH -p $DEBUG
+fi
 echo "Done."
 exit 0
\ No newline at end of file
@@ -0,0 +1 @@
+../find-query/segments.py
\ No newline at end of file
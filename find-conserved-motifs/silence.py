@@ -1,23 +1,29 @@
 #!/usr/bin/python
 
 import sys
-import pandas as pd
 import numpy as np
 import getopt
 import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from corpus import read_series
+
+USAGE = 'silence.py -i <input_data_path> (required) -r <results_path> (required) -l <expected_motif_length>  (required) -t <threshold> (optional, default 1.0) -j <jobs> (optional, default 1)'
 
 def read_config(argv):
     try:
-        opts, args = getopt.getopt(argv,"hi:r:l:",["input_data_path=","results_path=","expected_motif_length="])
+        opts, args = getopt.getopt(argv,"hi:r:l:t:j:",["input_data_path=","results_path=","expected_motif_length=","threshold=","jobs="])
     except getopt.GetoptError:
-        print('silence.py -i <input_data_path> (required) -r <results_path> (required) -l <expected_motif_length>  (required)')
+        print(USAGE)
         sys.exit(1)
     results_path = "./results/hnrnpa2b1_binding_sites_fshape"
     expected_motif_length = 13
+    threshold = 1.0
+    jobs = 1
     required_arguments_count = 0
     for opt, arg in opts:
         if opt == '-h':
-            print('silence.py -i <input_data_path> (required) -r <results_path> (required) -l <expected_motif_length>  (required)')
+            print(USAGE)
             sys.exit(0)
         elif opt in ("-i", "--input_data_path"):
             input_data_path = arg
@@ -28,40 +34,60 @@ def read_config(argv):
         elif opt in ("-l", "--expected_motif_length"):
             expected_motif_length = int(arg)
             required_arguments_count = required_arguments_count + 1
+        elif opt in ("-t", "--threshold"):
+            threshold = float(arg)
+        elif opt in ("-j", "--jobs"):
+            jobs = int(arg)
     if required_arguments_count != 3:
-        print('silence.py -i <input_data_path> (required) -r <results_path> (required) -l <expected_motif_length>  (required)')
+        print(USAGE)
         sys.exit(1)
-    return input_data_path, results_path, expected_motif_length
-    
-def process(input_file_path, output_file_path, expected_motif_length):
-    results_df = pd.read_csv(input_file_path)
-    values = results_df["Reactivity"].iloc[:].values
-    mask = [0] * len(values)
+    return input_data_path, results_path, expected_motif_length, threshold, jobs
 
-    for i in range(len(values)):
-        if abs(values[i]) > 1.0:
-            for j in range(2 * expected_motif_length - 1):
-                window_idx = i - expected_motif_length + 1 + j
-                if window_idx < len(values) and mask[window_idx] == 0:
-                    mask[window_idx] = 1;
-    count = 0;
-    for i in range(len(values)):
-        if not np.isnan(values[i]) and mask[i] == 0:
-            results_df["Reactivity"].iat[i] = float("nan")
-            count = count + 1;
+def keep_mask(values, expected_motif_length, threshold=1.0):
+    # a data point is kept when a point with |reactivity| > threshold lies
+    # less than expected_motif_length positions away from it, i.e. the mask of
+    # such points dilated by a window of 2 * expected_motif_length - 1
+    hits = np.concatenate(([0], np.cumsum(np.abs(values) > threshold)))
+    idx = np.arange(len(values))
+    lo = np.maximum(idx - expected_motif_length + 1, 0)
+    hi = np.minimum(idx + expected_motif_length, len(values))
+    return hits[hi] - hits[lo] > 0
+
+def silence(values, expected_motif_length, threshold=1.0):
+    return np.where(keep_mask(values, expected_motif_length, threshold), values, np.nan)
+
+def write_series(output_file_path, values, bases):
+    reactivity = np.array(values.tolist(), dtype=str)
+    reactivity[np.isnan(values)] = 'NA'
+    lines = np.char.add(np.char.add(reactivity, ','), bases.astype(str))
+    with open(output_file_path, 'w') as f:
+        f.write('Reactivity,Sequence\n')
+        if len(lines):
+            f.write('\n'.join(lines) + '\n')
+
+def process(input_file_path, output_file_path, expected_motif_length, threshold=1.0):
+    values, bases, _ = read_series(input_file_path)
+    write_series(output_file_path, silence(values, expected_motif_length, threshold), bases)
+
+def process_all(input_files, output_files, expected_motif_length, threshold=1.0, jobs=1):
+    if jobs > 1 and len(input_files) > 1:
+        with ProcessPoolExecutor(jobs) as pool:
+            list(pool.map(process, input_files, output_files, repeat(expected_motif_length), repeat(threshold), chunksize=max(1, len(input_files) // (4 * jobs))))
+    else:
+        for input_file, output_file in zip(input_files, output_files):
+            process(input_file, output_file, expected_motif_length, threshold)
 
-    results_df.to_csv(output_file_path,index=False, na_rep='NA')
-    
 def filter_useless_data_points(argv):
-    input_data_path, results_path, expected_motif_length = read_config(argv)
+    input_data_path, results_path, expected_motif_length, threshold, jobs = read_config(argv)
     print('Input data path: {}'.format(input_data_path))
     print('Expected motif length: {}'.format(expected_motif_length))
     print('Results path: {}'.format(results_path))
     
-    for filename in os.listdir(input_data_path):
-        current_file = os.path.join(input_data_path,filename)
-        if current_file.endswith(".csv") and os.path.isfile(current_file):
-            process(current_file, os.path.join(results_path,filename), expected_motif_length)
+    filenames = [filename for filename in os.listdir(input_data_path)
+                 if filename.endswith(".csv") and os.path.isfile(os.path.join(input_data_path,filename))]
+    process_all([os.path.join(input_data_path,filename) for filename in filenames],
+                [os.path.join(results_path,filename) for filename in filenames],
+                expected_motif_length, threshold, jobs)
 
 def main(argv):
     filter_useless_data_points(argv)
@@ -0,0 +1,145 @@
+#! /usr/bin/env python
+"""Content-addressed on-disk cache of computed results.
+
+An entry is a set of named numpy arrays stored in
+``<hash[:2]>/<kind>-<hash>.npz``. The hash covers everything the result depends
+on (the data of the series, the query, the window length, ...), so a changed
+input simply gets a new key and nothing has to be invalidated. Entries are
+written atomically and can be shared by worker processes. Every hit refreshes
+the modification time of an entry, and when the cache grows over its size limit
+the entries used least recently are removed first.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+VERSION = 3
+# default size limit, in megabytes
+MAX_SIZE = 1024
+
+
+def key(kind: str, *parts) -> str:
+    """Key of a result of `kind` computed from arrays and JSON serializable data."""
+    h = hashlib.sha1(f"{VERSION} {kind}".encode())
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            h.update(str((part.dtype.str, part.shape)).encode())
+            h.update(np.ascontiguousarray(part).tobytes())
+        else:
+            h.update(json.dumps(part).encode())
+        h.update(b"\0")
+    return f"{kind}-{h.hexdigest()}"
+
+
+class Cache:
+    def __init__(self, directory: str, max_size: float = MAX_SIZE):
+        self.directory = directory
+        self.max_bytes = int(max_size * 2**20)
+
+    def path(self, key: str) -> str:
+        digest = key.rpartition("-")[2]
+        return os.path.join(self.directory, digest[:2], f"{key}.npz")
+
+    def get(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return arrays
+
+    def put(self, key: str, **arrays: np.ndarray):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # unique per process and thread, writers of the same entry never clash
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+
+    def entries(self) -> List[Tuple[str, int, float]]:
+        """(path, size, last use) of every entry, the least recently used first."""
+        result = []
+        if not os.path.isdir(self.directory):
+            return result
+        for name in os.listdir(self.directory):
+            subdirectory = os.path.join(self.directory, name)
+            if not os.path.isdir(subdirectory):
+                continue
+            for entry in os.scandir(subdirectory):
+                if entry.name.endswith(".npz"):
+                    stat = entry.stat()
+                    result.append((entry.path, stat.st_size, stat.st_mtime))
+        result.sort(key=lambda entry: entry[2])
+        return result
+
+    def evict(self, max_bytes: int = None) -> int:
+        """Remove the least recently used entries over the size limit.
+
+        Returns the number of entries removed.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.entries()
+        size = sum(entry[1] for entry in entries)
+        removed = 0
+        for path, entry_size, _ in entries:
+            if size <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+            removed += 1
+        return removed
+
+    def purge(self) -> int:
+        return self.evict(0)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="inspect or purge a cache of computed results"
+    )
+    parser.add_argument("directory", help="cache directory")
+    parser.add_argument("--purge", help="remove all entries", action="store_true")
+    parser.add_argument(
+        "--max-size",
+        help="remove the least recently used entries until the cache is at most "
+        "this many megabytes",
+        type=float,
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    cache = Cache(args.directory)
+    if args.purge:
+        print(f"{cache.purge()} entries removed", file=sys.stderr)
+    elif args.max_size is not None:
+        removed = cache.evict(int(args.max_size * 2**20))
+        print(f"{removed} entries removed", file=sys.stderr)
+    entries = cache.entries()
+    size = sum(entry[1] for entry in entries)
+    print(f"{len(entries)} entries, {size / 2**20:.1f} MB in {args.directory}")
+    kinds = {}
+    for path, entry_size, _ in entries:
+        kind = os.path.basename(path).rpartition("-")[0]
+        count, total = kinds.get(kind, (0, 0))
+        kinds[kind] = count + 1, total + entry_size
+    for kind, (count, total) in sorted(kinds.items()):
+        print(f"  {kind}: {count} entries, {total / 2**20:.1f} MB")
+    if entries:
+        for label, (_, _, used) in (("least", entries[0]), ("most", entries[-1])):
+            print(f"{label} recently used: {time.ctime(used)}")
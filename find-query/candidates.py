@@ -0,0 +1,228 @@
+"""The motifs found in the profiled inputs, as one table.
+
+Every motif of every input is a candidate match of the query. The data under
+the candidates are gathered into 2-D arrays, one row per candidate and one
+column per position of the query: fSHAPE and SHAPE values and base codes. The
+filters, scores, sorting and export then work on all candidates at once
+instead of one input copy per motif.
+"""
+
+import csv
+import os
+from typing import Dict, List
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+PYRIMIDINES = np.frombuffer(b"CTU", dtype=np.uint8)
+PURINES = np.frombuffer(b"AG", dtype=np.uint8)
+UNKNOWN = ord("N")
+# the columns of the exported table before the fSHAPE and SHAPE data
+SUMMARY = ["Sample", "Range", "Sequence", "Z-normalized", "Distance", "Sequence-Score"]
+# the column after them when the motifs were tested, see shuffles.py
+PVALUE = "P-value"
+
+
+def base_codes(bases: np.ndarray) -> np.ndarray:
+    """The ASCII codes of an array of single bases."""
+    return np.ascontiguousarray(bases, dtype="S1").view(np.uint8)
+
+
+def score_table(query_bases: np.ndarray) -> np.ndarray:
+    """Score of every base code at every position of the query, one row each.
+
+    2 for the query's base (unless it is unknown), 1 for another purine or
+    pyrimidine where the query has one.
+    """
+    codes = base_codes(query_bases)[:, None]
+    alphabet = np.arange(256, dtype=np.uint8)[None, :]
+    match = (codes != UNKNOWN) & (alphabet == codes)
+    similar = (np.isin(codes, PYRIMIDINES) & np.isin(alphabet, PYRIMIDINES)) | (
+        np.isin(codes, PURINES) & np.isin(alphabet, PURINES)
+    )
+    return 2 * match + (similar & ~match)
+
+
+def window_sequence_scores(bases: np.ndarray, query_bases: np.ndarray) -> np.ndarray:
+    """Sequence score against the query of every window of a series of bases.
+
+    This is Candidates.sequence_scores for all windows at once, with one table
+    lookup per position of the query instead of a window array.
+    """
+    table = score_table(query_bases)
+    codes = base_codes(bases)
+    count = max(len(codes) - len(table) + 1, 0)
+    scores = np.zeros(count, dtype=np.int64)
+    for j, row in enumerate(table):
+        scores += row[codes[j : j + count]]
+    return scores
+
+
+def header(m: int, pvalues: bool = False) -> List[str]:
+    return (
+        SUMMARY
+        + ([PVALUE] if pvalues else [])
+        + [f"fSHAPE-{i + 1}" for i in range(m)]
+        + [f"SHAPE-{i + 1}" for i in range(m)]
+    )
+
+
+class Candidates:
+    def __init__(
+        self,
+        inputs: List,
+        series: np.ndarray,
+        motifs: np.ndarray,
+        starts: np.ndarray,
+        znorms: np.ndarray,
+        fshapes: np.ndarray,
+        shapes: np.ndarray,
+        bases: np.ndarray,
+        pvalues: np.ndarray = None,
+    ):
+        # candidate i is motif motifs[i] of inputs[series[i]], found at
+        # starts[i] with the z-normalized distance znorms[i] to the query, and
+        # the p-value pvalues[i] if the candidates were tested
+        self.inputs = inputs
+        self.series = series
+        self.motifs = motifs
+        self.starts = starts
+        self.znorms = znorms
+        self.fshapes = fshapes
+        self.shapes = shapes
+        self.bases = bases
+        self.pvalues = pvalues
+
+    @staticmethod
+    def from_inputs(inputs: List, m: int) -> "Candidates":
+        """All motifs of the profiled inputs, in the order of the inputs and their motifs."""
+        series, motifs, starts, znorms = [], [], [], []
+        fshapes, shapes, bases = [], [], []
+        for i, input in enumerate(inputs):
+            if not input.motifs:
+                continue
+            index = np.array([motif["motifs"][1] for motif in input.motifs])
+            series.append(np.full(len(index), i))
+            motifs.append(np.arange(len(index)))
+            starts.append(index)
+            znorms.append(np.asarray(input.profile["mp"])[index])
+            fshapes.append(sliding_window_view(input.fshapes, m)[index])
+            shapes.append(sliding_window_view(input.shapes, m)[index])
+            bases.append(sliding_window_view(base_codes(input.bases), m)[index])
+        if not series:
+            return Candidates(
+                inputs,
+                np.empty(0, np.int64),
+                np.empty(0, np.int64),
+                np.empty(0, np.int64),
+                np.empty(0),
+                np.empty((0, m)),
+                np.empty((0, m)),
+                np.empty((0, m), np.uint8),
+            )
+        return Candidates(
+            inputs,
+            np.concatenate(series),
+            np.concatenate(motifs),
+            np.concatenate(starts),
+            np.concatenate(znorms),
+            np.concatenate(fshapes),
+            np.concatenate(shapes),
+            np.concatenate(bases),
+        )
+
+    def __len__(self) -> int:
+        return len(self.series)
+
+    def take(self, rows) -> "Candidates":
+        """The candidates selected by a mask or an array of indices, in that order."""
+        return Candidates(
+            self.inputs,
+            self.series[rows],
+            self.motifs[rows],
+            self.starts[rows],
+            self.znorms[rows],
+            self.fshapes[rows],
+            self.shapes[rows],
+            self.bases[rows],
+            None if self.pvalues is None else self.pvalues[rows],
+        )
+
+    def sorted(self) -> "Candidates":
+        """The candidates by increasing z-normalized distance, ties kept in order."""
+        return self.take(np.argsort(self.znorms, kind="stable"))
+
+    def with_nans(self) -> np.ndarray:
+        return np.isnan(self.fshapes).any(axis=1)
+
+    def negative(self, query) -> np.ndarray:
+        """Candidates under fSHAPE 1.0 where the query is above it."""
+        return ((query.fshapes > 1.0) & (self.fshapes <= 1.0)).any(axis=1)
+
+    def distances(self, query) -> np.ndarray:
+        """Euclidean distance of the candidate data to the query."""
+        differences = self.fshapes - query.fshapes
+        # one dot product per row, the same sums as np.linalg.norm of each row
+        squares = np.matmul(differences[:, None, :], differences[:, :, None])
+        return np.sqrt(squares[:, 0, 0])
+
+    def sequence_scores(self, query) -> np.ndarray:
+        """2 per base matching the query, 1 per purine or pyrimidine matching."""
+        table = score_table(query.bases)
+        return table[np.arange(len(table)), self.bases].sum(axis=1)
+
+    def to_inputs(self, count: int = None) -> List:
+        """The first `count` candidates as copies of their inputs with one motif each."""
+        result = []
+        for i, k in zip(self.series[:count], self.motifs[:count]):
+            copy = self.inputs[i].copy()
+            copy.motifs = [copy.motifs[k]]
+            result.append(copy)
+        return result
+
+    def summary(self, query) -> List[List]:
+        """The values of the SUMMARY columns of the exported table, and PVALUE."""
+        m = len(query)
+        names = [os.path.splitext(input.name)[0] for input in self.inputs]
+        columns = [
+            [names[i] for i in self.series.tolist()],
+            [f"{start}-{start + m}" for start in self.starts.tolist()],
+            [row.tobytes().decode() for row in self.bases],
+            self.znorms.tolist(),
+            self.distances(query).tolist(),
+            self.sequence_scores(query).tolist(),
+        ]
+        if self.pvalues is not None:
+            columns.append(self.pvalues.tolist())
+        return columns
+
+    def records(self, query) -> List[Dict]:
+        """The summary columns as one dict per candidate."""
+        names = header(0, self.pvalues is not None)
+        return [dict(zip(names, row)) for row in zip(*self.summary(query))]
+
+    def write_csv(self, query, path: str):
+        with open(path, "w") as f:
+            writer = csv.writer(f)
+            writer.writerow(header(len(query), self.pvalues is not None))
+            writer.writerows(
+                [*summary, *fshapes, *shapes]
+                for summary, fshapes, shapes in zip(
+                    zip(*self.summary(query)),
+                    self.fshapes.tolist(),
+                    self.shapes.tolist(),
+                )
+            )
+
+    def write_parquet(self, query, path: str):
+        """Write the table of write_csv as a Parquet file, this needs pyarrow."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        columns = self.summary(query) + list(self.fshapes.T) + list(self.shapes.T)
+        table = pa.table(
+            [np.ascontiguousarray(column) for column in columns],
+            names=header(len(query), self.pvalues is not None),
+        )
+        pq.write_table(table, path + ".tmp")
+        os.replace(path + ".tmp", path)
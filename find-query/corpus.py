@@ -0,0 +1,422 @@
+#! /usr/bin/env python
+"""Compiled, memory-mapped corpus of reactivity series.
+
+A corpus directory holds every series of a data set concatenated into three
+arrays (``fshapes.npy``, ``bases.npy``, ``shapes.npy``) and an ``index.json``
+with the series names, their offsets into the arrays and the source files the
+corpus was compiled from. Opening a corpus maps the arrays read-only, so the
+series handed out are views and nothing is parsed or copied. The corpus is
+compiled again only when a source file was added, removed or its content
+changed.
+
+A source file may hold one series or many, see `read_records`.
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import sys
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+VERSION = 1
+ARRAYS = {"fshapes": np.float64, "bases": "S1", "shapes": np.float64}
+# files of many series are parsed this many bytes at a time
+CHUNK_SIZE = 1 << 22
+HEADER = re.compile(r"^>[ \t]*(\S*).*(?:\n|$)", re.MULTILINE)
+
+
+def read_series(path: str):
+    """Read a reactivity file into (fshapes, bases, shapes) arrays.
+
+    Both the whitespace separated 1/2/3-column format (fSHAPE, sequence, SHAPE)
+    and the comma separated files with a header line written by the
+    preprocessing of find-conserved-motifs are accepted. ``NA`` is read as NaN
+    for the numeric columns and as ``N`` for the sequence.
+    """
+    with open(path) as f:
+        return parse_series(f.read())
+
+
+def parse_series(text: str):
+    first = text.lstrip().split("\n", 1)[0]
+    if "," in first:
+        text = text.replace(",", " ")
+        first = first.replace(",", " ")
+    if first and not is_number(first.split()[0]):
+        # skip the header line
+        text = text.lstrip().split("\n", 1)[1] if "\n" in text.lstrip() else ""
+        first = text.lstrip().split("\n", 1)[0]
+
+    tokens = text.split()
+    columns = len(first.split())
+    if columns not in (1, 2, 3) or len(tokens) % columns != 0:
+        return read_series_by_line(text)
+
+    rows = len(tokens) // columns
+    try:
+        fshapes = to_floats(tokens[0::columns])
+        shapes = (
+            to_floats(tokens[2::columns]) if columns == 3 else np.full(rows, np.nan)
+        )
+    except ValueError:
+        # some lines have a different number of columns, report the offending one
+        return read_series_by_line(text)
+    bases = to_bases(tokens[1::columns]) if columns > 1 else np.full(rows, b"N", "S1")
+    return fshapes, bases, shapes
+
+
+def read_series_by_line(text: str):
+    fshapes, bases, shapes = [], [], []
+    for line in map(str.split, text.splitlines()):
+        if not line:
+            continue
+        if len(line) not in (1, 2, 3):
+            raise RuntimeError(f"Invalid line: {line}")
+        fshapes.append(float(line[0].replace("NA", "nan")))
+        bases.append(line[1].replace("NA", "N") if len(line) > 1 else "N")
+        shapes.append(
+            float(line[2].replace("NA", "nan")) if len(line) > 2 else math.nan
+        )
+    return np.array(fshapes), np.array(bases, dtype="S1"), np.array(shapes)
+
+
+def read_records(
+    path: str, chunk_size: int = CHUNK_SIZE
+) -> Iterator[Tuple[Optional[str], np.ndarray, np.ndarray, np.ndarray]]:
+    """Read the series of a file one by one, as (name, fshapes, bases, shapes).
+
+    A file may hold many series, e.g. all transcripts of an export, in one of
+    two layouts: every series starts with a header line ``>name`` followed by
+    lines of the format of `read_series`, or every line starts with the name of
+    its series (``name fSHAPE [sequence [SHAPE]]``) and a series ends where the
+    name changes. Such files are parsed `chunk_size` bytes at a time, only the
+    chunk and the series being read are held in memory. Any other file is a
+    single series read by `read_series`, named None.
+    """
+    with open(path) as f:
+        first = ""
+        for line in f:
+            if line.strip():
+                first = line.strip()
+                break
+        f.seek(0)
+        if first.startswith(">"):
+            yield from read_headed_records(f, chunk_size)
+            return
+        tokens = first.split()
+        if not (
+            2 <= len(tokens) <= 4 and not is_number(tokens[0]) and is_number(tokens[1])
+        ):
+            yield (None, *parse_series(f.read()))
+            return
+        yield from read_named_lines(f, chunk_size)
+
+
+def chunks(f, chunk_size: int) -> Iterator[str]:
+    """Blocks of whole lines of about `chunk_size` bytes."""
+    rest = ""
+    while True:
+        block = f.read(chunk_size)
+        if not block:
+            break
+        block = rest + block
+        end = block.rfind("\n") + 1
+        rest = block[end:]
+        if end:
+            yield block[:end]
+    if rest:
+        yield rest
+
+
+def join(name: Optional[str], parts: List[Tuple]):
+    return (name, *(np.concatenate(column) for column in zip(*parts)))
+
+
+def read_headed_records(f, chunk_size: int):
+    name, parts = None, []
+    for text in chunks(f, chunk_size):
+        pieces = HEADER.split(text)
+        # the text before the first header continues the current series
+        parts.append(parse_series(pieces[0]))
+        for header, body in zip(pieces[1::2], pieces[2::2]):
+            if name is not None:
+                yield join(name, parts)
+            name, parts = header, [parse_series(body)]
+    if name is not None:
+        yield join(name, parts)
+
+
+def read_named_lines(f, chunk_size: int):
+    name, parts = None, []
+    for text in chunks(f, chunk_size):
+        names, *columns = parse_named_lines(text)
+        if len(names) == 0:
+            continue
+        starts = np.flatnonzero(names[1:] != names[:-1]) + 1
+        bounds = np.concatenate(([0], starts, [len(names)]))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            part = tuple(column[start:end] for column in columns)
+            if names[start] == name:
+                parts.append(part)
+                continue
+            if name is not None:
+                yield join(name, parts)
+            name, parts = str(names[start]), [part]
+    if name is not None:
+        yield join(name, parts)
+
+
+def parse_named_lines(text: str):
+    """Names and (fshapes, bases, shapes) of lines starting with a series name."""
+    tokens = text.split()
+    columns = len(text.lstrip().split("\n", 1)[0].split())
+    if columns in (2, 3, 4) and len(tokens) % columns == 0:
+        rows = len(tokens) // columns
+        try:
+            fshapes = to_floats(tokens[1::columns])
+            shapes = (
+                to_floats(tokens[3::columns]) if columns == 4 else np.full(rows, np.nan)
+            )
+            bases = (
+                to_bases(tokens[2::columns])
+                if columns > 2
+                else np.full(rows, b"N", "S1")
+            )
+            return np.array(tokens[0::columns]), fshapes, bases, shapes
+        except ValueError:
+            pass
+    # some lines have a different number of columns
+    names, rows = [], []
+    for line in text.splitlines():
+        line = line.split()
+        if not line:
+            continue
+        if len(line) not in (2, 3, 4):
+            raise RuntimeError(f"Invalid line: {line}")
+        names.append(line[0])
+        rows.append(" ".join(line[1:]))
+    return (np.array(names, dtype=str), *read_series_by_line("\n".join(rows)))
+
+
+def is_number(token: str) -> bool:
+    try:
+        float(token.replace("NA", "nan"))
+    except ValueError:
+        return False
+    return True
+
+
+def to_floats(tokens: List[str]) -> np.ndarray:
+    column = np.array(tokens)
+    column[column == "NA"] = "nan"
+    return column.astype(np.float64)
+
+
+def to_bases(tokens: List[str]) -> np.ndarray:
+    column = np.array(tokens)
+    column[column == "NA"] = "N"
+    return column.astype("S1")
+
+
+class Corpus:
+    """Series of a compiled corpus, backed by (memory-mapped) arrays."""
+
+    def __init__(
+        self,
+        names: List[str],
+        offsets: np.ndarray,
+        fshapes: np.ndarray,
+        bases: np.ndarray,
+        shapes: np.ndarray,
+        sources: Optional[List[Dict]] = None,
+        directory: Optional[str] = None,
+    ):
+        self.names = names
+        self.offsets = offsets
+        self.fshapes = fshapes
+        self.bases = bases
+        self.shapes = shapes
+        self.sources = sources or []
+        self.directory = directory
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return (self.series(i) for i in range(len(self)))
+
+    def digest(self) -> str:
+        """Hash identifying the content of the corpus."""
+        sources = [(source["path"], source["sha1"]) for source in self.sources]
+        return hashlib.sha1(json.dumps(sources).encode()).hexdigest()
+
+    def series(self, i: int):
+        """Return (name, fshapes, bases, shapes) of the i-th series as views."""
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return (
+            self.names[i],
+            self.fshapes[start:end],
+            self.bases[start:end],
+            self.shapes[start:end],
+        )
+
+
+def fingerprint(path: str) -> Dict:
+    stat = os.stat(path)
+    return {
+        "path": os.path.abspath(path),
+        "mtime": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha1": file_hash(path),
+    }
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def compile_corpus(paths: List[str], directory: str) -> Corpus:
+    """Parse all files in `paths` and write them as a corpus into `directory`.
+
+    A series without a name of its own (see `read_records`) is named after its
+    file.
+    """
+    names, series = [], []
+    for path in paths:
+        for name, *arrays in read_records(path):
+            names.append(name or os.path.basename(path))
+            series.append(arrays)
+    lengths = [len(fshapes) for fshapes, _, _ in series]
+    offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+
+    os.makedirs(directory, exist_ok=True)
+    for i, (name, dtype) in enumerate(ARRAYS.items()):
+        data = [s[i] for s in series]
+        save_array(
+            directory, name, np.concatenate(data) if data else np.empty(0, dtype)
+        )
+
+    index = {
+        "version": VERSION,
+        "names": names,
+        "offsets": offsets.tolist(),
+        "sources": [fingerprint(path) for path in paths],
+    }
+    # the index is written last, a corpus without one is never opened
+    save_index(directory, index)
+    return load_corpus(directory)
+
+
+def save_array(directory: str, name: str, data: np.ndarray):
+    path = os.path.join(directory, f"{name}.npy")
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, data)
+    os.replace(path + ".tmp", path)
+
+
+def save_index(directory: str, index: Dict):
+    path = os.path.join(directory, "index.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(path + ".tmp", path)
+
+
+def read_index(directory: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(directory, "index.json")) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return index if index.get("version") == VERSION else None
+
+
+def load_corpus(directory: str) -> Corpus:
+    """Open a compiled corpus, the arrays are memory-mapped read-only."""
+    index = read_index(directory)
+    if index is None:
+        raise RuntimeError(f"{directory} does not contain a compiled corpus")
+    arrays = [
+        np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+        for name in ARRAYS
+    ]
+    return Corpus(
+        index["names"],
+        np.asarray(index["offsets"], dtype=np.int64),
+        *arrays,
+        sources=index["sources"],
+        directory=directory,
+    )
+
+
+def is_up_to_date(directory: str, index: Dict, paths: List[str]) -> bool:
+    sources = index["sources"]
+    if [source["path"] for source in sources] != [os.path.abspath(p) for p in paths]:
+        return False
+
+    touched = False
+    for source in sources:
+        try:
+            stat = os.stat(source["path"])
+        except OSError:
+            return False
+        if stat.st_mtime_ns == source["mtime"] and stat.st_size == source["size"]:
+            continue
+        # the file was touched, it is stale only if its content differs
+        if (
+            stat.st_size != source["size"]
+            or file_hash(source["path"]) != source["sha1"]
+        ):
+            return False
+        source["mtime"] = stat.st_mtime_ns
+        touched = True
+
+    if touched:
+        save_index(directory, index)
+    return True
+
+
+def open_corpus(directory: str, paths: Optional[List[str]] = None) -> Corpus:
+    """Open the corpus in `directory`, compiling it first if it is out of date.
+
+    Without `paths` the corpus is checked against the files it was compiled
+    from.
+    """
+    index = read_index(directory)
+    if index is not None and paths is None:
+        paths = [source["path"] for source in index["sources"]]
+        if not all(os.path.exists(path) for path in paths):
+            # the sources are gone, the compiled corpus is all there is
+            return load_corpus(directory)
+    if paths is None:
+        raise RuntimeError(f"{directory} does not contain a compiled corpus")
+
+    if index is not None and is_up_to_date(directory, index, paths):
+        return load_corpus(directory)
+    return compile_corpus(paths, directory)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="compile reactivity files into a memory-mapped corpus"
+    )
+    parser.add_argument("-o", "--output", help="corpus directory", required=True)
+    parser.add_argument("inputs", help="path to fSHAPE or SHAPE files", nargs="+")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    corpus = open_corpus(args.output, args.inputs)
+    print(
+        f"{len(corpus)} series, {len(corpus.fshapes)} nucleotides in {args.output}",
+        file=sys.stderr,
+    )
@@ -1,87 +1,206 @@
 #! /usr/bin/env python
 import argparse
-import csv
+import glob
+import importlib.util
 import math
-import multiprocessing
 import os
-import random
 import sys
-from typing import List, Dict
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List
 
-import matrixprofile as mp
 import numpy as np
-from matplotlib import pyplot as plt
 
+import instrument
+import shuffles
+import plots
+import search
+import service
+from cache import MAX_SIZE, Cache, key
+from candidates import Candidates, window_sequence_scores
+from corpus import Corpus, open_corpus, read_records, read_series
+from index import WindowIndex
+from segments import Segments
 
-class Nucleotide:
-    def __init__(self, fshape: float, base: str = "N", shape: float = math.nan):
-        self.fshape = fshape
-        self.base = base
-        self.shape = shape
-
-    def __repr__(self):
-        return str(self.__dict__)
+# inputs are sent to the workers in batches of at least this many nucleotides
+MIN_BATCH_LENGTH = 20000
 
 
 class Input:
     @staticmethod
     def from_file(path: str):
-        with open(path) as f:
-            lines = f.readlines()
-
-        lines = map(str.strip, lines)
-        lines = map(lambda x: x.replace("NA", "nan"), lines)
-        lines = map(str.split, lines)
-
-        nucleotides = []
-        for line in lines:
-            if len(line) == 1:
-                nucleotides.append(Nucleotide(float(line[0])))
-            elif len(line) == 2:
-                nucleotides.append(Nucleotide(float(line[0]), line[1]))
-            elif len(line) == 3:
-                nucleotides.append(Nucleotide(float(line[0]), line[1], float(line[2])))
-            else:
-                raise RuntimeError(f"Invalid line: {line}")
-        return Input(os.path.basename(path), nucleotides)
+        fshapes, bases, shapes = read_series(path)
+        return Input(os.path.basename(path), fshapes, bases, shapes)
 
-    def __init__(self, name: str, nucleotides: List[Nucleotide]):
+    @staticmethod
+    def from_corpus(corpus: Corpus):
+        return [Input(*series) for series in corpus]
+
+    @staticmethod
+    def from_paths(paths: List[str]) -> Iterator["Input"]:
+        """Every series of the files, read one at a time (see corpus.read_records).
+
+        A file of a single series gives an input named after the file.
+        """
+        for path in paths:
+            for name, fshapes, bases, shapes in read_records(path):
+                yield Input(name or os.path.basename(path), fshapes, bases, shapes)
+
+    def __init__(
+        self,
+        name: str,
+        fshapes: np.ndarray,
+        bases: np.ndarray = None,
+        shapes: np.ndarray = None,
+    ):
         self.name = name
-        self.nucleotides = nucleotides
-        self.fshapes = []
-        self.shapes = []
-        self.bases = []
+        self.fshapes = np.asarray(fshapes, dtype=np.float64)
+        self.bases = (
+            np.full(len(self.fshapes), b"N", dtype="S1")
+            if bases is None
+            else np.asarray(bases, dtype="S1")
+        )
+        self.shapes = (
+            np.full(len(self.fshapes), np.nan)
+            if shapes is None
+            else np.asarray(shapes, dtype=np.float64)
+        )
         self.profile: Dict = dict()
         self.motifs: List[Dict] = []
 
-        for nt in nucleotides:
-            self.fshapes.append(nt.fshape)
-            self.shapes.append(nt.shape)
-            self.bases.append(nt.base)
-
     def __repr__(self):
         return str(self.__dict__)
 
     def __len__(self):
         return len(self.fshapes)
 
-    def compute_profile(self, query):
-        if np.sum(np.isfinite(input.fshapes)) < len(query):
-            return
+    def sequence(self, start: int = 0, end: int = None) -> str:
+        return self.bases[start:end].tobytes().decode()
+
+    def compute_profiles(
+        self,
+        queries: List["Input"],
+        pool=None,
+        chunks: int = 1,
+        cache: Cache = None,
+        min_sequence_score: int = None,
+    ):
+        """Profile the input against queries which all have the same length.
+
+        The input is preprocessed and its window statistics computed once, the
+        distance profiles of all queries are evaluated in one batch. With a
+        process `pool` the windows are split into `chunks` tasks evaluated in
+        parallel. With a `cache` only the profiles of queries not profiled
+        against the same data before are computed. With `min_sequence_score`
+        only the windows whose sequence scores at least that against a query
+        are compared with it, the others are left out of its profile as
+        windows over undefined data points are. Returns a copy of the input
+        per query, holding that query's profile and motifs.
+        """
+        length = len(queries[0])
+        copies = [self.copy() for _ in queries]
+        if np.sum(np.isfinite(self.fshapes)) < length:
+            return copies
+
+        missing = list(range(len(queries)))
+        ts = None
+        if cache is not None:
+            # the preprocessed input is stored once for all queries of its length
+            series = key("series", self.fshapes)
+            ts_key = key("ts", series, length)
+            entry = cache.get(ts_key)
+            if entry is not None:
+                ts = entry["ts"]
+            keys = [
+                key("profile", series, *constraint(query, min_sequence_score))
+                for query in queries
+            ]
+            missing = []
+            for i, (copy, query) in enumerate(zip(copies, queries)):
+                entry = cache.get(keys[i])
+                if entry is None:
+                    missing.append(i)
+                    continue
+                if ts is None:
+                    ts = search.preprocess_series(self.fshapes, length)
+                    cache.put(ts_key, ts=ts)
+                copy.restore_profile(query, ts, entry)
+            if not missing:
+                return copies
+
+        # windows over undefined data points are never computed
+        computed = Segments.from_series(self.fshapes).window_mask(length)
+        if min_sequence_score is not None:
+            passing = [
+                window_sequence_scores(self.bases, queries[i].bases)
+                >= min_sequence_score
+                for i in missing
+            ]
+            computed &= np.any(passing, axis=0)
+            if not computed.any():
+                return copies
+        if ts is None:
+            ts = search.preprocess_series(self.fshapes, length)
+            if cache is not None:
+                cache.put(ts_key, ts=ts)
+        fshapes = np.array([queries[i].fshapes for i in missing])
+        if pool is None:
+            distances = search.chunk_distance_profiles(ts, fshapes, computed)
+        else:
+            distances = search.parallel_distance_profiles(
+                ts, fshapes, pool, chunks, computed
+            )
+        for k, (i, profile) in enumerate(zip(missing, distances)):
+            if min_sequence_score is not None:
+                profile[~passing[k]] = np.inf
+            copy = copies[i]
+            copy.profile = search.join_profile(ts, queries[i].fshapes, profile)
+            copy.motifs = search.discover_motifs(copy.profile)
+            if cache is not None:
+                cache.put(keys[i], **copy.saved_profile())
+        return copies
+
+    def saved_profile(self) -> Dict[str, np.ndarray]:
+        """The profile and motifs as arrays, see `restore_profile`.
+
+        The preprocessed input is not part of them, it is the same for all
+        queries of one length.
+        """
+        neighbors = [motif["neighbors"] for motif in self.motifs]
+        return {
+            "mp": self.profile["mp"],
+            "motifs": np.array(
+                [motif["motifs"] for motif in self.motifs], dtype=np.int64
+            ).reshape(-1, 2),
+            "neighbors": np.array(sum(neighbors, []), dtype=np.int64),
+            "counts": np.array([len(n) for n in neighbors], dtype=np.int64),
+        }
 
-        self.profile = mp.compute(
-            self.fshapes,
-            len(query),
-            query.fshapes,
-            n_jobs=multiprocessing.cpu_count(),
-            preprocessing_kwargs={"window": len(query)},
-        )
-        self.motifs = mp.discover.motifs(self.profile, int(len(query) / 2), 10)[
-            "motifs"
+    def restore_profile(
+        self, query: "Input", ts: np.ndarray, saved: Dict[str, np.ndarray]
+    ):
+        self.profile = search.join_profile(ts, query.fshapes, saved["mp"])
+        ends = np.cumsum(saved["counts"])
+        self.motifs = [
+            {
+                "motifs": list(motif),
+                "neighbors": list(saved["neighbors"][end - n : end]),
+            }
+            for motif, n, end in zip(saved["motifs"], saved["counts"], ends)
         ]
+        self.profile["motifs"] = self.motifs
+
+    def shuffle(self):
+        order = np.random.permutation(len(self))
+        self.fshapes = self.fshapes[order]
+        self.bases = self.bases[order]
+        self.shapes = self.shapes[order]
 
     def copy(self):
-        obj = Input(self.name, self.nucleotides)
+        # the arrays are shared, only the per-motif state is separate
+        obj = Input(self.name, self.fshapes, self.bases, self.shapes)
         obj.profile = self.profile
         obj.motifs = self.motifs
         return obj
@@ -89,210 +208,751 @@ class Input:
 
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--query", help="path to pattern data")
+    parser.add_argument(
+        "--query",
+        help="path to pattern data or to a directory of them, may be repeated",
+        action="append",
+    )
+    parser.add_argument(
+        "--output",
+        help="directory for the results, with more than one query each query "
+        "gets a subdirectory named after it",
+        default=".",
+    )
     parser.add_argument(
         "--scramble",
         help="shuffle each input file in a random manner to test robustness",
         action="store_true",
     )
-    parser.add_argument("inputs", help="path to fSHAPE or SHAPE files", nargs="+")
+    parser.add_argument(
+        "--corpus",
+        help="directory of the compiled corpus of the inputs, it is compiled when "
+        "missing or out of date and used instead of the inputs when none are given",
+    )
+    parser.add_argument(
+        "--jobs",
+        help="number of worker processes (default: number of CPUs)",
+        type=int,
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        "--split-length",
+        help="inputs longer than this are split over all workers, shorter ones "
+        "are profiled whole by one worker",
+        type=int,
+        default=1000000,
+    )
+    parser.add_argument(
+        "--stream",
+        help="profile the inputs while they are read, batches of series are sent "
+        "to the workers as soon as they are parsed",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--top",
+        help="report only the TOP best motifs over all inputs, found with an "
+        "index that skips the windows and inputs which cannot be among them",
+        type=int,
+    )
+    parser.add_argument(
+        "--min-sequence-score",
+        help="compare with a query only the windows whose sequence scores at "
+        "least this against the query's bases (see Sequence-Score), the "
+        "others are skipped before any reactivity is compared",
+        type=int,
+    )
+    parser.add_argument(
+        "--permutations",
+        help="shuffle every input with motifs N times, and report the p-value of "
+        "every motif against the best matches in the shuffles of its input",
+        metavar="N",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--seed",
+        help="seed of the shuffles of --permutations (default: %(default)s)",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--cache",
+        help="directory of a cache of the profiles and motifs, the profiles of "
+        "inputs and queries seen before are not computed again",
+    )
+    parser.add_argument(
+        "--cache-size",
+        help="size limit of the cache in megabytes, the least recently used "
+        "entries are removed over it (default: %(default)s)",
+        type=float,
+        default=MAX_SIZE,
+    )
+    parser.add_argument(
+        "--parquet",
+        help="also write the tables as output.parquet and output-filtered.parquet "
+        "(needs pyarrow)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--no-plots",
+        help="do not draw the plots, the data to draw them is saved nevertheless",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--plots-only",
+        help="only draw the plots of the results saved in --output by an earlier run",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--run-report",
+        help="record the time, CPU time, peak memory and counters of every stage "
+        "into run-report.json in --output",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--run-summary",
+        help="like --run-report, and print a summary of the stages to stderr",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--serve",
+        help="keep the --corpus in memory and answer queries sent as JSON lines "
+        "on standard input, or on --socket, until it is closed",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--socket", help="with --serve, listen on a Unix socket at this path"
+    )
+    parser.add_argument(
+        "--concurrency",
+        help="with --serve, the number of queries answered at once "
+        "(default: %(default)s)",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "inputs",
+        help="path to fSHAPE or SHAPE files, to directories of them or quoted "
+        "glob patterns of them",
+        nargs="*",
+    )
     args = parser.parse_args()
-    if not args.query:
+    if args.plots_only:
+        return args
+    if args.serve:
+        if not args.corpus:
+            parser.error("--serve needs --corpus")
+        if args.query or args.run_report or args.run_summary:
+            parser.error(
+                "--serve takes the queries from the requests, and "
+                "cannot record a run report"
+            )
+        if args.concurrency < 1:
+            parser.error("--concurrency must be at least 1")
+        return args
+    if args.socket:
+        parser.error("--socket needs --serve")
+    if not args.query or not (args.inputs or args.corpus):
         parser.print_help()
         sys.exit(1)
+    if args.stream and (args.top or args.corpus):
+        parser.error("--stream cannot be combined with --top or --corpus")
+    if args.permutations < 0:
+        parser.error("--permutations must not be negative")
+    if args.parquet and importlib.util.find_spec("pyarrow") is None:
+        parser.error("--parquet needs pyarrow")
     return args
 
 
-def separate_motifs(inputs: List[Input]):
+def expand_paths(paths: List[str]) -> List[str]:
+    """The files in `paths`, with directories and glob patterns expanded."""
     result = []
-    for input in inputs:
-        if len(input.motifs) == 1:
-            result.append(input)
+    for path in paths:
+        if not os.path.exists(path) and glob.has_magic(path):
+            result.extend(sorted(glob.glob(path)))
+        elif os.path.isdir(path):
+            names = sorted(os.listdir(path))
+            result.extend(
+                os.path.join(path, name)
+                for name in names
+                if os.path.isfile(os.path.join(path, name))
+            )
         else:
-            for motif in input.motifs:
-                copy = input.copy()
-                copy.motifs = [motif]
-                result.append(copy)
+            result.append(path)
     return result
 
 
-def filter_motifs_with_nans(inputs: List[Input], query):
-    result = []
-    for input in inputs:
-        index = input.motifs[0]["motifs"][1]
-        found = input.fshapes[index : index + len(query)]
-        if np.isnan(found).any():
-            continue
-        result.append(input)
-    return result
-
-
-def filter_negative_motifs(inputs: List[Input], query):
-    result = []
-    for input in inputs:
-        index = input.motifs[0]["motifs"][1]
-        found = np.array(input.fshapes[index : index + len(query)])
-
-        for i in range(len(query)):
-            if query.fshapes[i] > 1.0 and found[i] <= 1.0:
-                break
-        else:
-            result.append(input)
-    return result
-
-
-def euclidean(input: Input, query: Input):
-    index = input.motifs[0]["motifs"][1]
-    data = np.array(input.fshapes[index : index + len(query)])
-    return np.linalg.norm(data - np.array(query.fshapes))
-
-
-def znorm_euclidean(input: Input):
-    return input.profile["mp"][input.motifs[0]["motifs"][1]]
-
-
-def sequence_score(input: Input, query: Input):
-    score = 0
-    for i in range(len(query)):
-        nt1 = query.bases[i]
-        if nt1 == "N":
-            continue
-        index = input.motifs[0]["motifs"][1]
-        nt2 = input.bases[index + i]
-        if nt1 == nt2:
-            score += 2
-        elif nt1 in "CTU" and nt2 in "CTU":
-            score += 1
-        elif nt1 in "AG" and nt2 in "AG":
-            score += 1
-    return score
-
+def compute_profiles(
+    inputs: List[Input],
+    queries: List[Input],
+    jobs: int = 1,
+    split_length: int = 0,
+    cache: Cache = None,
+    min_sequence_score: int = None,
+):
+    """Profile every input against every query, in one pass per query length.
+
+    Returns a list of profiled inputs for each query, in the order of `inputs`.
+    """
+    results = [[] for _ in queries]
+    lengths = sorted(set(len(query) for query in queries))
+    for length in lengths:
+        group = [i for i, query in enumerate(queries) if len(query) == length]
+        group_queries = [queries[i] for i in group]
+        count_profiled(inputs, group_queries, min_sequence_score)
+        profiled = profile_inputs(
+            inputs, group_queries, jobs, split_length, cache, min_sequence_score
+        )
+        for copies in profiled:
+            for i, copy in zip(group, copies):
+                results[i].append(copy)
+    return results
+
+
+def constraint(query: Input, min_sequence_score: int = None):
+    """What the profile of an input against the query depends on, besides the input."""
+    if min_sequence_score is None:
+        return (query.fshapes,)
+    return query.fshapes, query.bases, min_sequence_score
+
+
+def count_profiled(
+    inputs: List[Input], queries: List[Input], min_sequence_score: int = None
+):
+    if not instrument.enabled():
+        return
+    length = len(queries[0])
+    windows = sum(max(len(input) - length + 1, 0) for input in inputs)
+    masks = [
+        Segments.from_series(input.fshapes).window_mask(length) for input in inputs
+    ]
+    defined = sum(mask.sum() for mask in masks)
+    evaluated = len(queries) * defined
+    if min_sequence_score is not None:
+        evaluated = sum(
+            np.sum(
+                mask
+                & (
+                    window_sequence_scores(input.bases, query.bases)
+                    >= min_sequence_score
+                )
+            )
+            for query in queries
+            for input, mask in zip(inputs, masks)
+        )
+    skipped = sum(np.sum(np.isfinite(input.fshapes)) < length for input in inputs)
+    instrument.count("series profiled", len(queries) * (len(inputs) - skipped))
+    instrument.count("series too short", len(queries) * skipped)
+    instrument.count("windows evaluated", evaluated)
+    instrument.count("NaN windows skipped", len(queries) * (windows - defined))
+    if min_sequence_score is not None:
+        instrument.count("sequence windows skipped", len(queries) * defined - evaluated)
+
+
+def stream_profiles(
+    inputs: Iterable[Input],
+    queries: List[Input],
+    jobs: int = 1,
+    split_length: int = 0,
+    cache: Cache = None,
+    min_sequence_score: int = None,
+):
+    """Profile inputs while they are read, the result is that of compute_profiles.
+
+    Consecutive inputs are gathered into batches of MIN_BATCH_LENGTH
+    nucleotides, which are sent to the workers as soon as they are complete.
+    At most 2 * `jobs` batches wait for a worker, so the reading never runs far
+    ahead of the profiling. Inputs longer than `split_length` are split over all
+    workers, as by profile_inputs.
+    """
+    lengths = sorted(set(len(query) for query in queries))
+    groups = [
+        [i for i, query in enumerate(queries) if len(query) == length]
+        for length in lengths
+    ]
+    group_queries = [[queries[i] for i in group] for group in groups]
+    results = [[] for _ in queries]
+
+    def collect(profiled: List[List[List[Input]]]):
+        for copies in profiled:
+            for group, group_copies in zip(groups, copies):
+                for i, copy in zip(group, group_copies):
+                    results[i].append(copy)
+
+    def done(result) -> Future:
+        future = Future()
+        future.set_result(result)
+        return future
+
+    read = 0
+    if jobs <= 1:
+        for input in inputs:
+            read += 1
+            for group in group_queries:
+                count_profiled([input], group, min_sequence_score)
+            collect(profile_groups([input], group_queries, cache, min_sequence_score))
+        instrument.count("series", read)
+        return results
+
+    pending = deque()
+    with ProcessPoolExecutor(jobs) as pool:
+        batch, batch_length = [], 0
+
+        def submit():
+            for group in group_queries:
+                count_profiled(batch, group, min_sequence_score)
+            pending.append(
+                pool.submit(
+                    profile_groups, batch, group_queries, cache, min_sequence_score
+                )
+            )
 
-def export_csv(inputs: List[Input], query: Input, path: str):
-    objects = []
+        for input in inputs:
+            read += 1
+            if len(input) > split_length > 0:
+                # the batch before it first, the inputs stay in order
+                if batch:
+                    submit()
+                    batch, batch_length = [], 0
+                for group in group_queries:
+                    count_profiled([input], group, min_sequence_score)
+                copies = [
+                    input.compute_profiles(
+                        group, pool, 4 * jobs, cache, min_sequence_score
+                    )
+                    for group in group_queries
+                ]
+                pending.append(done([copies]))
+            else:
+                batch.append(input)
+                batch_length += len(input)
+                if batch_length >= MIN_BATCH_LENGTH:
+                    submit()
+                    batch, batch_length = [], 0
+            while len(pending) > 2 * jobs:
+                collect(pending.popleft().result())
+        if batch:
+            submit()
+        while pending:
+            collect(pending.popleft().result())
+    instrument.count("series", read)
+    return results
+
+
+def shuffled(inputs: Iterable[Input]) -> Iterator[Input]:
     for input in inputs:
-        sample = os.path.splitext(input.name)[0]
-        index = input.motifs[0]["motifs"][1]
-        range_ = f"{index}-{index + len(query)}"
-        sequence = "".join(input.bases[index : index + len(query)])
-        object = {
-            "Sample": sample,
-            "Range": range_,
-            "Sequence": sequence,
-            "Distance": euclidean(input, query),
-            "Z-normalized": znorm_euclidean(input),
-            "Sequence-Score": sequence_score(input, query),
-        }
-        for i in range(len(query)):
-            object.update({f"fSHAPE-{i + 1}": input.fshapes[index + i]})
-            object.update({f"SHAPE-{i + 1}": input.shapes[index + i]})
-        objects.append(object)
-
-    header = [
-        "Sample",
-        "Range",
-        "Sequence",
-        "Z-normalized",
-        "Distance",
-        "Sequence-Score",
+        input.shuffle()
+        yield input
+
+
+def profile_groups(
+    inputs: List[Input],
+    groups: List[List[Input]],
+    cache: Cache = None,
+    min_sequence_score: int = None,
+):
+    """The copies of every input profiled against every group of same-length queries."""
+    return [
+        [
+            input.compute_profiles(
+                queries, cache=cache, min_sequence_score=min_sequence_score
+            )
+            for queries in groups
+        ]
+        for input in inputs
     ]
-    for i in range(len(query)):
-        header.append(f"fSHAPE-{i + 1}")
-    for i in range(len(query)):
-        header.append(f"SHAPE-{i + 1}")
-
-    with open(path, "w") as f:
-        writer = csv.DictWriter(f, header)
-        writer.writeheader()
-        writer.writerows(objects)
 
 
-def draw_everything_highlight_motifs(query, inputs):
-    fig, axes = plt.subplots(len(inputs) + 1, 1, figsize=(6, 1.5 * len(inputs) + 1.5))
-
-    # draw query plot
-    axes[0].plot(np.arange(len(query)), query.fshapes)
-    axes[0].set_title("Query")
-
-    # draw input plots with motifs marked on top
-    for i, input in enumerate(inputs):
-        axes[i + 1].set_title(input.name)
-
-        data = input.fshapes
-        length = len(data)
-        axes[i + 1].plot(np.arange(length), data)
-        assert (
-            len(input.motifs) == 1
-        ), "separate_motifs() function should have made input.motifs a 1-element array"
+def profile_batch(
+    inputs: List[Input],
+    queries: List[Input],
+    cache: Cache = None,
+    min_sequence_score: int = None,
+):
+    return [
+        input.compute_profiles(
+            queries, cache=cache, min_sequence_score=min_sequence_score
+        )
+        for input in inputs
+    ]
 
-        mask = np.ones(length)
-        motif = input.motifs[0]["motifs"][1]
-        mask[motif : motif + len(query)] = 0
 
-        xs = np.arange(length)
-        ys = np.ma.masked_array(data, mask)
-        axes[i + 1].plot(xs, ys, label=f"[{motif}:{motif + len(query)}]")
+def batches(inputs: List[Input], jobs: int):
+    """Split the inputs into batches of consecutive ones with similar total length."""
+    total = sum(len(input) for input in inputs)
+    target = max(MIN_BATCH_LENGTH, math.ceil(total / (4 * jobs)))
+    result, batch, length = [], [], 0
+    for input in inputs:
+        batch.append(input)
+        length += len(input)
+        if length >= target:
+            result.append(batch)
+            batch, length = [], 0
+    if batch:
+        result.append(batch)
+    return result
 
-        mask = np.ones(length)
-        for neighbor in input.motifs[0]["neighbors"]:
-            mask[neighbor : neighbor + len(query)] = 0
-        ys = np.ma.masked_array(data, mask)
-        axes[i + 1].plot(xs, ys, label=f"neighbours [{motif}:{motif + len(query)}]")
 
-        axes[i + 1].legend()
+def profile_inputs(
+    inputs: List[Input],
+    queries: List[Input],
+    jobs: int,
+    split_length: int,
+    cache: Cache = None,
+    min_sequence_score: int = None,
+):
+    """Run Input.compute_profiles for all inputs on a pool of `jobs` processes.
+
+    Short inputs are profiled whole, in batches, by the workers. Inputs longer
+    than `split_length` have their windows split over all workers instead.
+    Without enough work for more than one batch everything runs in this process.
+    """
+    long = [len(input) > split_length > 0 for input in inputs]
+    short = batches([input for input, l in zip(inputs, long) if not l], jobs)
+    if jobs <= 1 or (len(short) <= 1 and not any(long)):
+        return profile_batch(inputs, queries, cache, min_sequence_score)
+
+    with ProcessPoolExecutor(jobs) as pool:
+        futures = [
+            pool.submit(profile_batch, batch, queries, cache, min_sequence_score)
+            for batch in short
+        ]
+        profiled = {}
+        for input, l in zip(inputs, long):
+            if l:
+                profiled[id(input)] = input.compute_profiles(
+                    queries, pool, 4 * jobs, cache, min_sequence_score
+                )
+        for batch, future in zip(short, futures):
+            for input, copies in zip(batch, future.result()):
+                profiled[id(input)] = copies
+    return [profiled[id(input)] for input in inputs]
+
+
+def window_index(
+    inputs: List[Input], m: int, corpus: Corpus = None, indexes: Dict = None
+) -> WindowIndex:
+    """The window index of length m of the inputs, kept in `indexes` by length.
+
+    With a corpus the index is stored in the corpus directory and reused by
+    later runs while the corpus is unchanged.
+    """
+    indexes = {} if indexes is None else indexes
+    if m not in indexes:
+        path = corpus and os.path.join(corpus.directory, f"index-{m}.npz")
+        indexes[m] = path and WindowIndex.load(path, corpus.digest())
+        if indexes[m] is None:
+            indexes[m] = WindowIndex.build(inputs, m)
+            if path:
+                indexes[m].save(path, corpus.digest())
+    return indexes[m]
+
+
+def search_top(
+    inputs: List[Input],
+    queries: List[Input],
+    k: int,
+    corpus: Corpus = None,
+    min_sequence_score: int = None,
+):
+    """Find the k best motifs for every query with a window index.
+
+    An index is built once per query length, see window_index. Returns a list
+    of profiled inputs for each query, already separated, filtered and sorted.
+    """
+    indexes = {}
+    return [
+        window_index(inputs, len(query), corpus, indexes).search(
+            query, inputs, k, min_sequence_score
+        )
+        for query in queries
+    ]
 
-    plt.tight_layout()
-    plt.savefig("motifs-highlighted.png")
 
+def permutation_test(
+    candidates: Candidates,
+    query: Input,
+    permutations: int,
+    seed: int = 0,
+    jobs: int = 1,
+) -> np.ndarray:
+    """The p-value of every candidate against shuffles of its input.
+
+    Only the inputs of the candidates are shuffled, `permutations` times each
+    (see shuffles.py). The blocks of shuffles are evaluated on a pool of
+    `jobs` processes, at most 2 * `jobs` of them waiting for a worker, and the
+    null distances of a block are dropped once the candidates of its input
+    were counted against them.
+    """
+    series = np.unique(candidates.series)
+    rows = {i: np.flatnonzero(candidates.series == i) for i in series.tolist()}
+    at_most = np.zeros(len(candidates), dtype=np.int64)
+    tasks = [
+        (i, block, count)
+        for i in series.tolist()
+        for block, count in shuffles.blocks(permutations)
+    ]
+    instrument.count("series tested", len(series))
+    instrument.count("permutations", len(series) * permutations)
+
+    def collect(i: int, null: np.ndarray):
+        at_most[rows[i]] += shuffles.count_at_most(null, candidates.znorms[rows[i]])
+
+    def arguments(i: int, block: int, count: int):
+        return candidates.inputs[i].fshapes, query.fshapes, seed, block, count
+
+    if jobs <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            collect(task[0], shuffles.null_distances(*arguments(*task)))
+    else:
+        pending = deque()
+        with ProcessPoolExecutor(jobs) as pool:
+            for task in tasks:
+                future = pool.submit(shuffles.null_distances, *arguments(*task))
+                pending.append((task[0], future))
+                while len(pending) > 2 * jobs:
+                    i, future = pending.popleft()
+                    collect(i, future.result())
+            while pending:
+                i, future = pending.popleft()
+                collect(i, future.result())
+    return (1 + at_most) / (1 + permutations)
+
+
+def export(candidates: Candidates, query: Input, path: str, parquet: bool = False):
+    """Write the candidates into path.csv, and path.parquet with `parquet`."""
+    candidates.write_csv(query, path + ".csv")
+    if parquet:
+        candidates.write_parquet(query, path + ".parquet")
+
+
+def report(
+    query: Input,
+    inputs: List[Input],
+    directory: str,
+    parquet: bool = False,
+    permutations: int = 0,
+    seed: int = 0,
+    jobs: int = 1,
+):
+    os.makedirs(directory, exist_ok=True)
+
+    with instrument.stage("separate_motifs"):
+        candidates = Candidates.from_inputs(inputs, len(query))
+        instrument.count("motifs", len(candidates))
+    with instrument.stage("filter_motifs_with_nans"):
+        found = len(candidates)
+        candidates = candidates.take(~candidates.with_nans())
+        instrument.count("NaN motifs skipped", found - len(candidates))
+    with instrument.stage("sort"):
+        candidates = candidates.sorted()
+    if permutations:
+        with instrument.stage("permutation_test"):
+            candidates.pvalues = permutation_test(
+                candidates, query, permutations, seed, jobs
+            )
+
+    with instrument.stage("export"):
+        export(candidates, query, os.path.join(directory, "output"), parquet)
+        instrument.count("motifs emitted", len(candidates))
+    # the best profiles are drawn from this later, see plots.render
+    with instrument.stage("save_plot_data"):
+        plots.save_plot_data(query, candidates.to_inputs(plots.PLOTTED), directory)
+
+    with instrument.stage("filter_negative_motifs"):
+        found = len(candidates)
+        candidates = candidates.take(~candidates.negative(query))
+        instrument.count("negative motifs skipped", found - len(candidates))
+    with instrument.stage("export"):
+        export(candidates, query, os.path.join(directory, "output-filtered"), parquet)
+        instrument.count("motifs emitted", len(candidates))
+
+
+class Service:
+    """A compiled corpus kept in memory to answer queries, see service.py.
+
+    A request names a query file ("query") or holds the query itself
+    ("fshapes", with "bases" and "name" optional). Without "top" every input is
+    profiled against the query, as a plain run does, with "top" only the "top"
+    best motifs are searched for with a window index, as with --top. Indexes are
+    built once per query length and kept. With "min_sequence_score" only
+    windows scoring at least that against the query's bases are compared with
+    it, as with --min-sequence-score. With "filtered" the motifs of
+    output-filtered.csv are returned instead of those of output.csv. The
+    response holds the SUMMARY columns of the table (see candidates.py) of
+    every motif, best first.
+
+    The corpus is checked for changes of its files at most every
+    RELOAD_INTERVAL seconds, and swapped for the new one when they changed.
+    Requests running by then finish on the corpus they started with.
+    """
+
+    RELOAD_INTERVAL = 2.0
+
+    def __init__(self, directory: str, paths: List[str] = None, cache: Cache = None):
+        self.directory = directory
+        self.paths = paths or None
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.index_lock = threading.Lock()
+        self.checked = time.monotonic()
+        self.state = self.load(open_corpus(directory, self.paths))
 
-def draw_just_motifs(query, inputs):
-    fig, axes = plt.subplots(len(inputs) + 1, 1, figsize=(6, 1.5 * len(inputs) + 1.5))
+    @staticmethod
+    def load(corpus: Corpus):
+        # the corpus, its inputs and their window indexes by length
+        return corpus, Input.from_corpus(corpus), {}
+
+    def current(self):
+        """The state of the corpus, reloaded first if its files changed."""
+        with self.lock:
+            if time.monotonic() - self.checked >= self.RELOAD_INTERVAL:
+                corpus = open_corpus(self.directory, self.paths)
+                if corpus.digest() != self.state[0].digest():
+                    self.state = self.load(corpus)
+                if self.cache is not None:
+                    self.cache.evict()
+                self.checked = time.monotonic()
+            return self.state
 
-    # draw query plot
-    xs = np.arange(len(query))
-    axes[0].set_title("Query")
-    axes[0].plot(xs, query.fshapes)
-    axes[0].set_xticks(xs)
-    axes[0].set_xticklabels(query.bases)
+    @staticmethod
+    def query(request: Dict) -> Input:
+        if "query" in request:
+            return Input.from_file(request["query"])
+        if "fshapes" not in request:
+            raise ValueError('a request needs "query" or "fshapes"')
+        fshapes = np.array(request["fshapes"], dtype=np.float64)
+        bases = request.get("bases")
+        if bases is not None:
+            if len(bases) != len(fshapes):
+                raise ValueError('"bases" and "fshapes" differ in length')
+            bases = np.array(list(bases.upper()), dtype="S1")
+        return Input(request.get("name", "query"), fshapes, bases)
+
+    def respond(self, request: Dict) -> Dict:
+        query = self.query(request)
+        m = len(query)
+        min_sequence_score = request.get("min_sequence_score")
+        if min_sequence_score is not None:
+            min_sequence_score = int(min_sequence_score)
+        corpus, inputs, indexes = self.current()
+        if request.get("top") is not None:
+            with self.index_lock:
+                index = window_index(inputs, m, corpus, indexes)
+            profiled = index.search(
+                query, inputs, int(request["top"]), min_sequence_score
+            )
+            candidates = Candidates.from_inputs(profiled, m)
+        else:
+            profiled = compute_profiles(
+                inputs, [query], 1, 0, self.cache, min_sequence_score
+            )[0]
+            candidates = Candidates.from_inputs(profiled, m)
+            candidates = candidates.take(~candidates.with_nans()).sorted()
+        if request.get("filtered"):
+            candidates = candidates.take(~candidates.negative(query))
+        return {
+            "query": query.name,
+            "corpus": corpus.digest(),
+            "motifs": candidates.records(query),
+        }
 
-    # draw plots with motifs
-    for i, input in enumerate(inputs):
-        index = input.motifs[0]["motifs"][1]
-        xticklabels = []
-        for j in range(len(query)):
-            xticklabels.append(f"{index + j}\n{input.bases[index + j]}")
 
-        axes[i + 1].set_title(input.name)
-        axes[i + 1].plot(xs, input.fshapes[index : index + len(query)])
-        axes[i + 1].set_xticks(xs)
-        axes[i + 1].set_xticklabels(xticklabels)
+def serve(args):
+    # imported now rather than by the first query, which would wait for it
+    import matrixprofile  # noqa: F401
 
-    plt.tight_layout()
-    plt.savefig("motifs-only.png")
+    cache = Cache(args.cache, args.cache_size) if args.cache else None
+    resident = Service(args.corpus, expand_paths(args.inputs), cache)
+    print(f"serving {len(resident.state[1])} series of {args.corpus}", file=sys.stderr)
+    if args.socket:
+        service.serve_socket(resident.respond, args.socket, args.concurrency)
+    else:
+        service.serve_stream(resident.respond, args.concurrency)
 
 
 if __name__ == "__main__":
     args = parse_args()
-
-    query = Input.from_file(args.query)
-    inputs = [Input.from_file(path) for path in args.inputs]
+    if args.run_report or args.run_summary:
+        instrument.enable()
+    if args.plots_only:
+        with instrument.stage("plots"):
+            plots.render(plots.result_directories(args.output), args.jobs)
+        instrument.save(args.output, args.run_summary)
+        sys.exit(0)
+    if args.serve:
+        serve(args)
+        sys.exit(0)
+
+    with instrument.stage("read"):
+        queries = [Input.from_file(path) for path in expand_paths(args.query)]
+        paths = expand_paths(args.inputs)
+        corpus = None
+        if args.corpus:
+            corpus = open_corpus(args.corpus, paths or None)
+            inputs = Input.from_corpus(corpus)
+        elif args.stream:
+            # the inputs are read while they are profiled, see stream_profiles
+            inputs = Input.from_paths(paths)
+        else:
+            inputs = list(Input.from_paths(paths))
+        instrument.count("queries", len(queries))
+        if not args.stream:
+            instrument.count("series", len(inputs))
+            instrument.count("nucleotides", sum(len(input) for input in inputs))
 
     if args.scramble:
-        for input in inputs:
-            random.shuffle(input.nucleotides)
-
-    for input in inputs:
-        input.compute_profile(query)
-
-    inputs = separate_motifs(inputs)
-    inputs = filter_motifs_with_nans(inputs, query)
-    inputs.sort(key=znorm_euclidean)
-
-    export_csv(inputs, query, "output.csv")
-
-    # draw up to 10 best profiles
-    draw_everything_highlight_motifs(query, inputs[:10])
-    draw_just_motifs(query, inputs[:10])
-
-    inputs = filter_negative_motifs(inputs, query)
-    export_csv(inputs, query, "output-filtered.csv")
+        corpus = None
+        inputs = shuffled(inputs)
+        if not args.stream:
+            inputs = list(inputs)
+
+    cache = Cache(args.cache, args.cache_size) if args.cache else None
+    if args.top:
+        with instrument.stage("search_top"):
+            profiled = search_top(
+                inputs, queries, args.top, corpus, args.min_sequence_score
+            )
+    else:
+        with instrument.stage("compute_profiles"):
+            if args.stream:
+                profiled = stream_profiles(
+                    inputs,
+                    queries,
+                    args.jobs,
+                    args.split_length,
+                    cache,
+                    args.min_sequence_score,
+                )
+            else:
+                profiled = compute_profiles(
+                    inputs,
+                    queries,
+                    args.jobs,
+                    args.split_length,
+                    cache,
+                    args.min_sequence_score,
+                )
+    if cache is not None:
+        cache.evict()
+    directories = []
+    for query, profiled in zip(queries, profiled):
+        directory = args.output
+        if len(queries) > 1:
+            directory = os.path.join(directory, os.path.splitext(query.name)[0])
+        with instrument.stage("report"):
+            report(
+                query,
+                profiled,
+                directory,
+                args.parquet,
+                args.permutations,
+                args.seed,
+                args.jobs,
+            )
+        directories.append(directory)
+
+    if not args.no_plots:
+        with instrument.stage("plots"):
+            plots.render(directories, args.jobs)
+    instrument.save(args.output, args.run_summary)
@@ -0,0 +1,222 @@
+"""Index over all windows of a set of inputs for a global top-k query search.
+
+For one window length the index keeps every input preprocessed the way the
+profiles are computed, the norms of its centred windows and a piecewise
+aggregate approximation (PAA) of every z-normalized window. The PAA gives a
+lower bound of the z-normalized Euclidean distance to a query, and the
+per-input bounding box of the PAA a lower bound for a whole input. A search
+visits the inputs by increasing bound and evaluates exactly only the windows
+whose bound is below the k-th best distance found so far. Windows over
+undefined data points are left out, as they are of the profiles.
+"""
+
+import heapq
+import os
+from typing import List
+
+import numpy as np
+
+import instrument
+import search
+from candidates import window_sequence_scores
+from segments import Segments
+
+SEGMENTS = 4
+# saved indexes of another version are rebuilt
+VERSION = 2
+
+
+def segment_bounds(m: int, segments: int) -> np.ndarray:
+    return np.linspace(0, m, min(segments, m) + 1).astype(int)
+
+
+def paa(windows: np.ndarray, means: np.ndarray, norms: np.ndarray, bounds):
+    """PAA of the z-normalized windows, one row per window."""
+    scale = norms / np.sqrt(windows.shape[1])
+    features = np.empty((len(windows), len(bounds) - 1))
+    for i, (start, end) in enumerate(zip(bounds, bounds[1:])):
+        features[:, i] = windows[:, start:end].mean(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (features - means[:, None]) / scale[:, None]
+
+
+class WindowIndex:
+    def __init__(self, m: int, offsets, ts, norms, features, boxes, valid):
+        self.m = m
+        # series i occupies ts[offsets[i]:offsets[i + 1]] and its windows start
+        # at offsets[i] - i * (m - 1) in the window arrays
+        self.offsets = offsets
+        self.ts = ts
+        self.norms = norms
+        self.features = features
+        self.boxes = boxes
+        self.valid = valid
+        self.bounds = segment_bounds(m, features.shape[1])
+
+    @staticmethod
+    def build(inputs, m: int, segments: int = SEGMENTS):
+        bounds = segment_bounds(m, segments)
+        lengths = [max(len(input), m - 1) for input in inputs]
+        offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+        ts = np.zeros(offsets[-1])
+        norms, features, boxes, valid = [], [], [], []
+        for input, start in zip(inputs, offsets):
+            profiled = np.sum(np.isfinite(input.fshapes)) >= m
+            series = search.preprocess_series(input.fshapes, m) if profiled else None
+            if series is not None:
+                ts[start : start + len(series)] = series
+            if len(input) >= m:
+                windows, norm = search.window_statistics(
+                    ts[start : start + len(input)], m
+                )
+                feature = paa(windows, windows.mean(axis=1), norm, bounds)
+            else:
+                norm, feature = np.empty(0), np.empty((0, len(bounds) - 1))
+            usable = profiled & (norm > 0) & np.isfinite(norm)
+            usable &= Segments.from_series(input.fshapes).window_mask(m)
+            norms.append(norm)
+            features.append(np.where(usable[:, None], feature, 0.0))
+            valid.append(usable)
+            box = np.full((2, len(bounds) - 1), np.inf)
+            if usable.any():
+                box = np.stack(
+                    [feature[usable].min(axis=0), feature[usable].max(axis=0)]
+                )
+            boxes.append(box)
+        return WindowIndex(
+            m,
+            offsets,
+            ts,
+            np.concatenate(norms),
+            np.concatenate(features),
+            np.stack(boxes) if boxes else np.empty((0, 2, len(bounds) - 1)),
+            np.concatenate(valid),
+        )
+
+    def save(self, path: str, key: str):
+        with open(path + ".tmp", "wb") as f:
+            np.savez(
+                f,
+                key=key,
+                version=VERSION,
+                m=self.m,
+                offsets=self.offsets,
+                ts=self.ts,
+                norms=self.norms,
+                features=self.features,
+                boxes=self.boxes,
+                valid=self.valid,
+            )
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def load(path: str, key: str):
+        """Load a saved index, None if there is none or it was built for other data."""
+        try:
+            data = np.load(path)
+        except (OSError, ValueError):
+            return None
+        if "version" not in data.files or int(data["version"]) != VERSION:
+            return None
+        if str(data["key"]) != key:
+            return None
+        return WindowIndex(
+            int(data["m"]),
+            data["offsets"],
+            data["ts"],
+            data["norms"],
+            data["features"],
+            data["boxes"],
+            data["valid"],
+        )
+
+    def windows(self, i: int) -> slice:
+        start = self.offsets[i] - i * (self.m - 1)
+        end = self.offsets[i + 1] - (i + 1) * (self.m - 1)
+        return slice(start, end)
+
+    def query_features(self, query: np.ndarray) -> np.ndarray:
+        windows = query[None, :]
+        norm = np.sqrt(np.sum(np.square(query - query.mean())))
+        return paa(windows, query.mean()[None], norm[None], self.bounds)[0]
+
+    def box_bounds(self, features: np.ndarray) -> np.ndarray:
+        """Lower bound of the distance from the query to any window of each input."""
+        gaps = np.maximum(
+            0.0,
+            np.maximum(self.boxes[:, 0] - features, features - self.boxes[:, 1]),
+        )
+        return np.sqrt(np.sum(np.diff(self.bounds) * np.square(gaps), axis=1))
+
+    def lower_bounds(self, i: int, features: np.ndarray) -> np.ndarray:
+        """Lower bound of the distance from the query to every window of input i."""
+        gaps = self.features[self.windows(i)] - features
+        bound = np.sqrt(np.sum(np.diff(self.bounds) * np.square(gaps), axis=1))
+        bound[~self.valid[self.windows(i)]] = np.inf
+        return bound
+
+    def search(self, query, inputs: List, k: int, min_sequence_score: int = None):
+        """Find the k best motifs of the inputs, ranked as export_csv ranks them.
+
+        This returns the first k entries of the list find-query builds from the
+        full profiles (motifs separated, motifs with NaN dropped, sorted by
+        z-normalized distance), but computes exact distances only for windows
+        whose lower bound is below the current k-th best distance. Windows
+        skipped that way get their lower bound in the profile, which is never
+        below a reported motif's distance and so cannot change which windows
+        the motif discovery picks before it. With `min_sequence_score` the
+        windows whose sequence scores less against the query are left out, as
+        by Input.compute_profiles.
+        """
+        m = self.m
+        features = self.query_features(query.fshapes)
+        if not np.all(np.isfinite(features)):
+            return []
+
+        best = []  # heap of (-distance, -input, -motif, candidate)
+        threshold = np.inf
+        box_bounds = self.box_bounds(features)
+        for i in np.argsort(box_bounds, kind="stable"):
+            if box_bounds[i] >= threshold:
+                break
+            windows = self.windows(i)
+            profile = self.lower_bounds(i, features)
+            if min_sequence_score is not None:
+                scores = window_sequence_scores(inputs[i].bases, query.bases)
+                passing = scores >= min_sequence_score
+                instrument.count(
+                    "sequence windows skipped", np.sum(self.valid[windows] & ~passing)
+                )
+                profile[~passing] = np.inf
+                if not passing.any():
+                    continue
+            exact = np.flatnonzero(profile < threshold)
+            instrument.count("series searched")
+            instrument.count("windows evaluated", len(exact))
+            instrument.count("windows pruned", len(profile) - len(exact))
+            ts = self.ts[self.offsets[i] : self.offsets[i] + len(inputs[i])]
+            profile[exact] = search.distance_profiles(
+                search.window_statistics(ts, m)[0][exact],
+                self.norms[windows][exact],
+                query.fshapes[None, :],
+            )[0]
+
+            input = inputs[i].copy()
+            input.profile = search.join_profile(ts, query.fshapes, profile)
+            motifs = search.discover_motifs(input.profile)
+            for j, motif in enumerate(motifs):
+                index = motif["motifs"][1]
+                if profile[index] >= threshold:
+                    break
+                if np.isnan(input.fshapes[index : index + m]).any():
+                    instrument.count("NaN motifs skipped")
+                    continue
+                candidate = input.copy()
+                candidate.motifs = [motif]
+                heapq.heappush(best, (-profile[index], -i, -j, candidate))
+                if len(best) > k:
+                    heapq.heappop(best)
+                if len(best) == k:
+                    threshold = -best[0][0]
+
+        return [entry[-1] for entry in sorted(best, reverse=True)]
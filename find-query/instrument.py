@@ -0,0 +1,189 @@
+"""Opt-in timing and memory instrumentation of the stages of a run.
+
+Code marks its stages with ``with stage("name"):`` and adds counters to the
+innermost running stage with ``count("name", n)``. Both do nothing unless
+recording was enabled, so the instrumentation costs nothing in normal runs.
+Stages inside stages are named after their parents (``report/export_csv``),
+and a stage run many times is reported once, with the number of calls and the
+totals. For every stage the wall clock time, the CPU time (including the
+worker processes which ended during it), the peak resident set size of this
+process during the stage and the largest one of its worker processes ended so
+far are recorded. The peak of a stage run many times is the largest of its
+calls. It is only measured per stage on Linux, elsewhere it is the peak since
+the process started.
+"""
+
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, TextIO
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def cpu_time() -> float:
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+def peak_rss(who: int = resource.RUSAGE_SELF) -> int:
+    return resource.getrusage(who).ru_maxrss * RSS_UNIT
+
+
+def reset_peak_rss() -> bool:
+    """Restart the peak resident set size of this process from its current size.
+
+    Only Linux allows it, by writing 5 to /proc/self/clear_refs.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def high_water_mark() -> int:
+    """Peak resident set size of this process since the last reset_peak_rss."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return peak_rss()
+
+
+class Recorder:
+    def __init__(self):
+        self.started = time.time()
+        self.wall = time.perf_counter()
+        self.cpu = cpu_time()
+        self.stages: Dict[str, Dict] = {}
+        self.active: List[str] = []
+        # peak of the process and of every active stage, up to the last reset
+        self.peak = peak_rss()
+        self.peaks: List[int] = []
+
+    def update_peaks(self):
+        # the peak since the last reset is one of all the active stages
+        peak = high_water_mark()
+        self.peak = max(self.peak, peak)
+        self.peaks = [max(p, peak) for p in self.peaks]
+
+    @contextmanager
+    def stage(self, name: str):
+        name = "/".join(self.active[-1:] + [name])
+        record = self.stages.setdefault(
+            name,
+            {
+                "name": name,
+                "calls": 0,
+                "wall_seconds": 0.0,
+                "cpu_seconds": 0.0,
+                "peak_rss_bytes": 0,
+                "children_peak_rss_bytes_so_far": 0,
+                "counters": {},
+            },
+        )
+        self.update_peaks()
+        reset_peak_rss()
+        self.active.append(name)
+        self.peaks.append(0)
+        wall, cpu = time.perf_counter(), cpu_time()
+        try:
+            yield
+        finally:
+            record["calls"] += 1
+            record["wall_seconds"] += time.perf_counter() - wall
+            record["cpu_seconds"] += cpu_time() - cpu
+            self.update_peaks()
+            self.active.pop()
+            peak = self.peaks.pop()
+            record["peak_rss_bytes"] = max(record["peak_rss_bytes"], peak)
+            record["children_peak_rss_bytes_so_far"] = peak_rss(
+                resource.RUSAGE_CHILDREN
+            )
+
+    def count(self, name: str, value: int = 1):
+        if not self.active:
+            return
+        counters = self.stages[self.active[-1]]["counters"]
+        counters[name] = counters.get(name, 0) + int(value)
+
+    def report(self) -> Dict:
+        self.update_peaks()
+        return {
+            "command": sys.argv,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "wall_seconds": time.perf_counter() - self.wall,
+            "cpu_seconds": cpu_time() - self.cpu,
+            "peak_rss_bytes": self.peak,
+            "children_peak_rss_bytes": peak_rss(resource.RUSAGE_CHILDREN),
+            "stages": list(self.stages.values()),
+        }
+
+    def summary(self, file: TextIO):
+        report = self.report()
+        print(
+            f"{'stage':<40} {'calls':>6} {'wall s':>9} {'cpu s':>9} "
+            f"{'peak MB':>8}  counters",
+            file=file,
+        )
+        for stage in report["stages"]:
+            counters = ", ".join(f"{k}={v}" for k, v in stage["counters"].items())
+            print(
+                f"{stage['name']:<40} {stage['calls']:>6} "
+                f"{stage['wall_seconds']:>9.3f} {stage['cpu_seconds']:>9.3f} "
+                f"{stage['peak_rss_bytes'] / 2**20:>8.1f}  {counters}",
+                file=file,
+            )
+        print(
+            f"{'total':<40} {'':>6} {report['wall_seconds']:>9.3f} "
+            f"{report['cpu_seconds']:>9.3f} {report['peak_rss_bytes'] / 2**20:>8.1f}",
+            file=file,
+        )
+
+
+_recorder: Optional[Recorder] = None
+
+
+def enable():
+    """Start recording, the stages before this call are not recorded."""
+    global _recorder
+    _recorder = Recorder()
+
+
+def enabled() -> bool:
+    return _recorder is not None
+
+
+@contextmanager
+def stage(name: str):
+    if _recorder is None:
+        yield
+        return
+    with _recorder.stage(name):
+        yield
+
+
+def count(name: str, value: int = 1):
+    if _recorder is not None:
+        _recorder.count(name, value)
+
+
+def save(directory: str, summary: bool = False):
+    """Write run-report.json into `directory`, and a summary to stderr if asked."""
+    if _recorder is None:
+        return
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "run-report.json"), "w") as f:
+        json.dump(_recorder.report(), f, indent=2)
+        f.write("\n")
+    if summary:
+        _recorder.summary(sys.stderr)
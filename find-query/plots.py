@@ -0,0 +1,172 @@
+"""Plots of the best motifs, drawn from the data a run saved.
+
+Every run saves what its plots show into ``plots.json`` in the output
+directory: the query and the best motifs together with their input series.
+The plots are drawn from that file, so drawing is separate from the search. It
+can be skipped, done later or spread over worker processes, and matplotlib is
+imported only by the processes which draw.
+"""
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+
+import instrument
+
+PLOT_DATA = "plots.json"
+# number of best motifs plotted
+PLOTTED = 10
+
+
+def pyplot():
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from matplotlib import pyplot as plt
+
+    return plt
+
+
+def save_plot_data(query, inputs: List, directory: str):
+    """Save the query and the best motifs of the (sorted) inputs for plotting."""
+    data = {
+        "query": {
+            "name": query.name,
+            "fshapes": query.fshapes.tolist(),
+            "sequence": query.sequence(),
+        },
+        "motifs": [
+            {
+                "name": input.name,
+                "fshapes": input.fshapes.tolist(),
+                "sequence": input.sequence(),
+                "index": int(input.motifs[0]["motifs"][1]),
+                "neighbors": [int(n) for n in input.motifs[0]["neighbors"]],
+            }
+            for input in inputs[:PLOTTED]
+        ],
+    }
+    path = os.path.join(directory, PLOT_DATA)
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+
+def load_plot_data(directory: str) -> Dict:
+    with open(os.path.join(directory, PLOT_DATA)) as f:
+        data = json.load(f)
+    for series in [data["query"]] + data["motifs"]:
+        series["fshapes"] = np.asarray(series["fshapes"], dtype=np.float64)
+    return data
+
+
+def draw_everything_highlight_motifs(saved: Dict, path: str):
+    plt = pyplot()
+    query, motifs = saved["query"], saved["motifs"]
+    m = len(query["fshapes"])
+    fig, axes = plt.subplots(
+        len(motifs) + 1, 1, figsize=(6, 1.5 * len(motifs) + 1.5), squeeze=False
+    )
+    axes = axes[:, 0]
+
+    # draw query plot
+    axes[0].plot(np.arange(m), query["fshapes"])
+    axes[0].set_title("Query")
+
+    # draw input plots with motifs marked on top
+    for i, input in enumerate(motifs):
+        axes[i + 1].set_title(input["name"])
+
+        data = input["fshapes"]
+        length = len(data)
+        axes[i + 1].plot(np.arange(length), data)
+
+        mask = np.ones(length)
+        motif = input["index"]
+        mask[motif : motif + m] = 0
+
+        xs = np.arange(length)
+        ys = np.ma.masked_array(data, mask)
+        axes[i + 1].plot(xs, ys, label=f"[{motif}:{motif + m}]")
+
+        mask = np.ones(length)
+        for neighbor in input["neighbors"]:
+            mask[neighbor : neighbor + m] = 0
+        ys = np.ma.masked_array(data, mask)
+        axes[i + 1].plot(xs, ys, label=f"neighbours [{motif}:{motif + m}]")
+
+        axes[i + 1].legend()
+
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close(fig)
+
+
+def draw_just_motifs(saved: Dict, path: str):
+    plt = pyplot()
+    query, motifs = saved["query"], saved["motifs"]
+    m = len(query["fshapes"])
+    fig, axes = plt.subplots(
+        len(motifs) + 1, 1, figsize=(6, 1.5 * len(motifs) + 1.5), squeeze=False
+    )
+    axes = axes[:, 0]
+
+    # draw query plot
+    xs = np.arange(m)
+    axes[0].set_title("Query")
+    axes[0].plot(xs, query["fshapes"])
+    axes[0].set_xticks(xs)
+    axes[0].set_xticklabels(list(query["sequence"]))
+
+    # draw plots with motifs
+    for i, input in enumerate(motifs):
+        index = input["index"]
+        sequence = input["sequence"][index : index + m]
+        xticklabels = []
+        for j in range(m):
+            xticklabels.append(f"{index + j}\n{sequence[j]}")
+
+        axes[i + 1].set_title(input["name"])
+        axes[i + 1].plot(xs, input["fshapes"][index : index + m])
+        axes[i + 1].set_xticks(xs)
+        axes[i + 1].set_xticklabels(xticklabels)
+
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close(fig)
+
+
+FIGURES = {
+    "motifs-highlighted.png": draw_everything_highlight_motifs,
+    "motifs-only.png": draw_just_motifs,
+}
+
+
+def draw(directory: str, figure: str):
+    FIGURES[figure](load_plot_data(directory), os.path.join(directory, figure))
+
+
+def result_directories(output: str) -> List[str]:
+    """The directory of every result saved in `output`, for --plots-only."""
+    if os.path.exists(os.path.join(output, PLOT_DATA)):
+        return [output]
+    return [
+        os.path.join(output, name)
+        for name in sorted(os.listdir(output))
+        if os.path.exists(os.path.join(output, name, PLOT_DATA))
+    ]
+
+
+def render(directories: List[str], jobs: int = 1):
+    """Draw all figures of the results in `directories`, each figure is a task."""
+    tasks = [(directory, figure) for directory in directories for figure in FIGURES]
+    instrument.count("figures", len(tasks))
+    if jobs <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            draw(*task)
+        return
+    with ProcessPoolExecutor(min(jobs, len(tasks))) as pool:
+        list(pool.map(draw, *zip(*tasks)))
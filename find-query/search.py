@@ -0,0 +1,163 @@
+"""Batched z-normalized distance profiles of queries against a series.
+
+The distances are the ones the matrixprofile AB-join computes between a series
+and a query of the window length, but all queries of one length are evaluated
+against the windows of a series with a single matrix product.
+"""
+
+import hashlib
+import threading
+from itertools import repeat
+from typing import Dict, List
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# correlations closer to 1 than this lose most of their digits in 1 - correlation
+CLOSE_CORRELATION = 1e-6
+
+# preprocess_series seeds the global numpy random state, one thread at a time
+_random_lock = threading.Lock()
+
+
+def preprocess_series(fshapes: np.ndarray, window: int) -> np.ndarray:
+    """The series preprocessed by matrixprofile, with noise seeded by its data.
+
+    preprocess adds a little random noise, drawn from the global numpy random
+    state. Seeding it from the series and the window length makes the result
+    independent of the order the series are profiled in, so streamed, parallel
+    and cached runs all agree.
+    """
+    from matrixprofile.preprocess import preprocess
+
+    digest = hashlib.sha1(np.ascontiguousarray(fshapes, dtype=np.float64).tobytes())
+    digest.update(str(window).encode())
+    with _random_lock:
+        state = np.random.get_state()
+        np.random.seed(int.from_bytes(digest.digest()[:4], "little"))
+        try:
+            return preprocess(fshapes, window=window)
+        finally:
+            np.random.set_state(state)
+
+
+def discover_motifs(profile: Dict) -> List[Dict]:
+    """Up to 10 motifs of a join profile, with the exclusion zone find-query uses.
+
+    matrixprofile takes most of the start-up time of find-query, it is only
+    imported once a profile is actually searched for motifs.
+    """
+    from matrixprofile import discover
+
+    return discover.motifs(profile, int(profile["w"] / 2), 10)["motifs"]
+
+
+def window_statistics(ts: np.ndarray, m: int):
+    """Return the windows of length `m` of `ts` and the norms of the centred windows.
+
+    The windows are a strided view of `ts`. Dividing the centred dot product of
+    two windows by both norms gives their Pearson correlation.
+    """
+    windows = sliding_window_view(ts, m)
+    means = windows.mean(axis=1)
+    norms = np.sqrt(np.sum(np.square(windows - means[:, None]), axis=1))
+    return windows, norms
+
+
+def distance_profiles(
+    windows: np.ndarray, norms: np.ndarray, queries: np.ndarray
+) -> np.ndarray:
+    """Z-normalized Euclidean distance of every query to every window.
+
+    `queries` holds one query per row. The result has one row per query and one
+    column per window. Constant windows or queries, and those with NaN, are at
+    an infinite distance.
+    """
+    m = queries.shape[1]
+    centred = queries - queries.mean(axis=1, keepdims=True)
+    query_norms = np.sqrt(np.sum(np.square(centred), axis=1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # einsum, unlike a BLAS product, gives every window the same result
+        # whichever other windows it is evaluated with
+        products = np.einsum("ij,kj->ik", centred, windows)
+        correlation = products / np.outer(query_norms, norms)
+        distances = np.sqrt(2.0 * m * (1.0 - np.minimum(correlation, 1.0)))
+        # 1 - correlation cancels for the closest windows, their distance is
+        # taken from the difference of the z-normalized windows instead, so an
+        # exact match is at 0
+        close = np.nonzero(correlation > 1.0 - CLOSE_CORRELATION)
+    if len(close[0]):
+        queried, matched = close
+        selected = windows[matched]
+        difference = (
+            centred[queried] / query_norms[queried, None]
+            - (selected - selected.mean(axis=1, keepdims=True)) / norms[matched, None]
+        )
+        distances[close] = np.sqrt(m * np.sum(np.square(difference), axis=1))
+    distances[~np.isfinite(distances)] = np.inf
+    return distances
+
+
+def chunk_distance_profiles(
+    ts: np.ndarray, queries: np.ndarray, computed: np.ndarray = None
+) -> np.ndarray:
+    """Distance profiles of the queries against the windows of (a piece of) a series.
+
+    With `computed`, a mask over the windows, only those windows are evaluated
+    and all others are at an infinite distance.
+    """
+    m = queries.shape[1]
+    if computed is None:
+        windows, norms = window_statistics(ts, m)
+        return distance_profiles(windows, norms, queries)
+    distances = np.full((len(queries), len(computed)), np.inf)
+    if computed.any():
+        windows = sliding_window_view(ts, m)[computed]
+        norms = np.sqrt(
+            np.sum(np.square(windows - windows.mean(axis=1, keepdims=True)), axis=1)
+        )
+        distances[:, computed] = distance_profiles(windows, norms, queries)
+    return distances
+
+
+def parallel_distance_profiles(
+    ts: np.ndarray, queries: np.ndarray, pool, chunks: int, computed: np.ndarray = None
+) -> np.ndarray:
+    """Like `chunk_distance_profiles`, with the windows split into `chunks` tasks.
+
+    Every task gets the piece of `ts` covering its windows, so the pieces of
+    neighbouring tasks overlap by the window length minus one.
+    """
+    m = queries.shape[1]
+    bounds = np.linspace(0, len(ts) - m + 1, chunks + 1, dtype=int)
+    bounds = [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+    pieces = [ts[start : end + m - 1] for start, end in bounds]
+    masks = [None if computed is None else computed[start:end] for start, end in bounds]
+    return np.hstack(
+        list(pool.map(chunk_distance_profiles, pieces, repeat(queries), masks))
+    )
+
+
+def join_profile(ts: np.ndarray, query: np.ndarray, distances: np.ndarray) -> Dict:
+    """Wrap a distance profile into the profile structure of matrixprofile.
+
+    This is what `matrixprofile.compute(ts, len(query), query)` returns, so the
+    result can be passed on to `matrixprofile.discover.motifs`.
+    """
+    m = len(query)
+    return {
+        "mp": distances,
+        "pi": np.where(np.isfinite(distances), 0, -1),
+        "rmp": None,
+        "rpi": None,
+        "lmp": None,
+        "lpi": None,
+        "metric": "euclidean",
+        "w": m,
+        "ez": int(np.ceil(m / 4.0)),
+        "join": True,
+        "sample_pct": 1,
+        "data": {"ts": ts, "query": query},
+        "class": "MatrixProfile",
+        "algorithm": "mpx",
+    }
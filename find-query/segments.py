@@ -0,0 +1,66 @@
+"""Series as segments of defined data points.
+
+Reactivity series have many undefined data points, and the prepared series of
+find-conserved-motifs are runs of defined ones separated by a single ``NA``.
+A `Segments` holds only the runs: their values one after another and their
+offsets. Windows are formed within a run only, so windows holding an undefined
+data point or crossing the gap between two runs never exist and no distance is
+ever computed for them. Positions are still those of the full series, so
+results refer to the same data points as before.
+"""
+
+import numpy as np
+
+
+class Segments:
+    def __init__(
+        self, values: np.ndarray, offsets: np.ndarray, starts: np.ndarray, length: int
+    ):
+        # run k is values[offsets[k]:offsets[k + 1]], it starts at starts[k] in
+        # the series of `length` data points it was cut from
+        self.values = values
+        self.offsets = offsets
+        self.starts = starts
+        self.length = length
+
+    @staticmethod
+    def from_series(series: np.ndarray) -> "Segments":
+        """The runs of finite values of a series."""
+        series = np.asarray(series, dtype=np.float64)
+        edges = np.diff(np.concatenate(([0], np.isfinite(series).astype(np.int8), [0])))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        offsets = np.concatenate(([0], np.cumsum(ends - starts, dtype=np.int64)))
+        values = series[np.isfinite(series)]
+        return Segments(values, offsets, starts, len(series))
+
+    def __len__(self) -> int:
+        return self.length
+
+    def positions(self) -> np.ndarray:
+        """Position in the series of every value."""
+        lengths = np.diff(self.offsets)
+        return np.repeat(self.starts - self.offsets[:-1], lengths) + np.arange(
+            len(self.values)
+        )
+
+    def window_indices(self, m: int) -> np.ndarray:
+        """Index in `values` of the first value of every window of length m."""
+        lengths = np.diff(self.offsets)
+        counts = np.maximum(lengths - m + 1, 0)
+        firsts = np.repeat(self.offsets[:-1], counts)
+        return (
+            firsts
+            + np.arange(counts.sum())
+            - np.repeat(np.cumsum(counts) - counts, counts)
+        )
+
+    def window_starts(self, m: int) -> np.ndarray:
+        """Position in the series of the first data point of every window of length m."""
+        return self.positions()[self.window_indices(m)]
+
+    def window_mask(self, m: int) -> np.ndarray:
+        """Which of the windows of length m of the full series lie within a run."""
+        mask = np.zeros(max(self.length - m + 1, 0), dtype=bool)
+        mask[self.window_starts(m)] = True
+        return mask
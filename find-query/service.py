@@ -0,0 +1,99 @@
+"""JSON-lines transport of the resident find-query service.
+
+Every request is one line holding a JSON object, and every response is one
+line holding a JSON object with the "id" of its request, if it had one.
+Requests are answered by a `respond` function, on up to `concurrency` threads
+at once; responses go out in the order they are ready, so clients with many
+requests in flight match them by id. A request which cannot be answered gets a
+response with an "error" message instead of ending the service.
+"""
+
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, TextIO
+
+Respond = Callable[[Dict], Dict]
+
+
+def answer(respond: Respond, line: str) -> str:
+    """The response line to a request line."""
+    request = {}
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            raise ValueError("a request must be a JSON object")
+        response = respond(request)
+    except Exception as e:
+        response = {"error": f"{type(e).__name__}: {e}"}
+    if isinstance(request, dict) and "id" in request:
+        response = {"id": request["id"], **response}
+    return json.dumps(response) + "\n"
+
+
+def serve_stream(
+    respond: Respond,
+    concurrency: int = 1,
+    input: TextIO = sys.stdin,
+    output: TextIO = sys.stdout,
+):
+    """Answer the requests read from `input` until it ends."""
+    lock = threading.Lock()
+    # requests are only read while a thread is free to answer them
+    slots = threading.BoundedSemaphore(concurrency)
+
+    def run(line: str):
+        try:
+            response = answer(respond, line)
+            with lock:
+                output.write(response)
+                output.flush()
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        for line in input:
+            if not line.strip():
+                continue
+            slots.acquire()
+            pool.submit(run, line)
+
+
+def serve_socket(respond: Respond, path: str, concurrency: int = 1):
+    """Answer the requests of the clients of a Unix socket at `path`.
+
+    A client may send many requests on one connection, its responses are
+    written back in the order of its requests. At most `concurrency` requests
+    of all clients are answered at once, the others wait.
+    """
+    slots = threading.BoundedSemaphore(concurrency)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                line = line.decode()
+                if not line.strip():
+                    continue
+                with slots:
+                    response = answer(respond, line)
+                self.wfile.write(response.encode())
+                self.wfile.flush()
+
+    if os.path.exists(path):
+        # left by a service which did not end cleanly
+        os.unlink(path)
+    server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    server.daemon_threads = True
+    # a terminated service cleans up as an interrupted one does
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
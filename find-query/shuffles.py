@@ -0,0 +1,69 @@
+"""Permutation test of the motifs found in the inputs.
+
+The null distribution of an input is the distance of the query to its best
+match in shuffles of the input. The defined data points of the input are
+shuffled among themselves and the undefined ones stay in place, so every
+shuffle has the same windows as the input. Shuffles are drawn in blocks of
+BLOCK, each from a generator seeded by the seed, the data of the input and the
+block, so the null does not depend on how the blocks are spread over workers.
+Within a block the shuffles are drawn and evaluated in batches of at most
+MAX_VALUES window values, and only the best distance of each is kept.
+
+The p-value of a motif at distance d is (1 + number of shuffles with a best
+distance of at most d) / (1 + number of shuffles).
+"""
+
+import hashlib
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import search
+from segments import Segments
+
+BLOCK = 100
+MAX_VALUES = 1 << 22
+
+
+def generator(fshapes: np.ndarray, seed: int, block: int) -> np.random.Generator:
+    digest = hashlib.sha1(np.ascontiguousarray(fshapes, dtype=np.float64).tobytes())
+    return np.random.default_rng(
+        [seed, int.from_bytes(digest.digest()[:8], "little"), block]
+    )
+
+
+def blocks(permutations: int):
+    """(block, number of shuffles) of every block of the permutations."""
+    return [
+        (block, min(BLOCK, permutations - start))
+        for block, start in enumerate(range(0, permutations, BLOCK))
+    ]
+
+
+def null_distances(
+    fshapes: np.ndarray, query: np.ndarray, seed: int, block: int, count: int
+) -> np.ndarray:
+    """Best distance of the query to each of the `count` shuffles of a block."""
+    m = len(query)
+    segments = Segments.from_series(fshapes)
+    index = segments.window_indices(m)
+    result = np.full(count, np.inf)
+    if not len(index):
+        return result
+    rng = generator(fshapes, seed, block)
+    batch = max(1, MAX_VALUES // (len(index) * m))
+    for start in range(0, count, batch):
+        end = min(start + batch, count)
+        shuffled = rng.permuted(np.tile(segments.values, (end - start, 1)), axis=1)
+        windows = sliding_window_view(shuffled, m, axis=1)[:, index].reshape(-1, m)
+        norms = np.sqrt(
+            np.sum(np.square(windows - windows.mean(axis=1, keepdims=True)), axis=1)
+        )
+        distances = search.distance_profiles(windows, norms, query[None, :])[0]
+        result[start:end] = distances.reshape(end - start, -1).min(axis=1)
+    return result
+
+
+def count_at_most(null: np.ndarray, distances: np.ndarray) -> np.ndarray:
+    """Number of values of the null at most each of the distances."""
+    return np.searchsorted(np.sort(null), distances, side="right")